@@ -1,6 +1,6 @@
 from django.contrib import admin
 from .models import User, Category, Shop, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, \
-    Contact, EmailVerificationToken
+    Contact, EmailVerificationToken, ImportJob
 # Register your models here.
 
 
@@ -87,3 +87,8 @@ class OrderItemAdmin(admin.ModelAdmin):
 @admin.register(EmailVerificationToken)
 class EmailVerificationTokenAdmin(admin.ModelAdmin):
     list_display = ('user', 'token', 'created_at', 'expires_at')
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'shop', 'phase', 'processed', 'created_at', 'finished_at')
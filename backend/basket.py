@@ -0,0 +1,397 @@
+from contextlib import nullcontext
+from functools import partial
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from backend.models import Order, OrderItem, ProductInfo
+from backend.serializers import ProductInfoSerializer, MAX_QUANTITY
+
+# Время хранения корзины в кэше после последнего изменения, с
+BASKET_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+
+# Добавляет позиции в корзину одним запросом; количество товара, который уже есть в корзине, увеличивается.
+# Если сумма количеств хотя бы одной позиции не помещается в integer, не записывается ни одна позиция
+ADD_BASKET_ITEMS_SQL = f"""
+    WITH item AS (
+        SELECT * FROM unnest(%s::bigint[], %s::integer[]) WITH ORDINALITY AS item(product_info_id, quantity, position)
+    )
+    INSERT INTO backend_orderitem (order_id, product_info_id, quantity)
+    SELECT %s, item.product_info_id, item.quantity
+    FROM item
+    WHERE NOT EXISTS (
+        SELECT 1 FROM item AS added
+        JOIN backend_orderitem AS existing ON existing.product_info_id = added.product_info_id
+        WHERE existing.order_id = %s AND existing.quantity::bigint + added.quantity > {MAX_QUANTITY}
+    )
+    ORDER BY item.position
+    ON CONFLICT ON CONSTRAINT unique_product_order
+    DO UPDATE SET quantity = backend_orderitem.quantity + EXCLUDED.quantity
+"""
+
+# Изменяет количество позиций корзины пользователя одним запросом; позиции других заказов не затрагиваются
+UPDATE_BASKET_ITEMS_SQL = """
+    UPDATE backend_orderitem AS order_item SET quantity = item.quantity
+    FROM unnest(%s::bigint[], %s::integer[]) AS item(id, quantity), backend_order AS basket
+    WHERE order_item.id = item.id AND basket.id = order_item.order_id
+      AND basket.user_id = %s AND basket.state = 'basket'
+    RETURNING order_item.id
+"""
+
+
+def add_basket_items(order_id, quantities):
+    """
+    Добавляет товары в корзину `order_id`: `quantities` - ID предложения -> количество.
+    Возвращает число добавленных и измененных позиций. Если количество товара в позиции превысило бы
+    `MAX_QUANTITY`, корзина не изменяется и выбрасывается ValueError.
+    """
+    if not quantities:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(ADD_BASKET_ITEMS_SQL, [list(quantities), list(quantities.values()), order_id, order_id])
+        if not cursor.rowcount:
+            raise ValueError(f'Количество товара в позиции должно быть не более {MAX_QUANTITY}')
+        return cursor.rowcount
+
+
+def update_basket_items(user_id, quantities):
+    """
+    Изменяет количество позиций в корзине пользователя `user_id`: `quantities` - ID позиции -> количество.
+    Возвращает ID измененных позиций.
+    """
+    if not quantities:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(UPDATE_BASKET_ITEMS_SQL, [list(quantities), list(quantities.values()), user_id])
+        return sorted(row[0] for row in cursor.fetchall())
+
+# Пересчитывает сумму и число позиций заказов по ценам оформления, а для корзин - по текущим ценам предложений
+ORDER_TOTALS_SQL = """
+    UPDATE backend_order AS target SET total_sum = totals.total_sum, item_count = totals.item_count
+    FROM (
+        SELECT orders.id,
+               coalesce(sum(coalesce(item.price, product_info.price)::bigint * item.quantity), 0) AS total_sum,
+               count(item.id) AS item_count
+        FROM backend_order AS orders
+        LEFT JOIN backend_orderitem AS item ON item.order_id = orders.id
+        LEFT JOIN backend_productinfo AS product_info ON product_info.id = item.product_info_id
+        WHERE {condition}
+        GROUP BY orders.id
+    ) AS totals
+    WHERE target.id = totals.id
+"""
+
+# Фиксирует в позициях заказа цены предложений на момент оформления
+SNAPSHOT_PRICES_SQL = """
+    UPDATE backend_orderitem AS item SET price = product_info.price
+    FROM backend_productinfo AS product_info
+    WHERE product_info.id = item.product_info_id AND item.order_id = %s AND item.price IS NULL
+"""
+
+
+def update_order_totals(order_ids):
+    """Пересчитывает сумму и число позиций заказов `order_ids` одним запросом."""
+    if not order_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(ORDER_TOTALS_SQL.format(condition='orders.id = ANY(%s::bigint[])'),
+                       [[int(order_id) for order_id in order_ids]])
+
+
+def update_basket_totals(user_id):
+    """Пересчитывает сумму и число позиций корзины пользователя одним запросом."""
+    with connection.cursor() as cursor:
+        cursor.execute(ORDER_TOTALS_SQL.format(condition="orders.user_id = %s AND orders.state = 'basket'"),
+                       [user_id])
+
+
+# Резервирует товар под все позиции заказа одним запросом. Строки предложений блокируются в порядке ID,
+# поэтому одновременные оформления заказов с общими товарами не взаимоблокируются; остаток уменьшается,
+# только если его хватает на все позиции. Вместе с остатком предложения обновляется запись каталога
+RESERVE_STOCK_SQL = """
+    WITH requested AS (
+        SELECT product_info.id, item.id AS item_id, item.quantity,
+               CASE WHEN product_info.version > shop.catalog_version
+                      OR product_info.retired_version <= shop.catalog_version THEN 0
+                    ELSE product_info.quantity END AS available
+        FROM backend_orderitem AS item
+        JOIN backend_productinfo AS product_info ON product_info.id = item.product_info_id
+        JOIN backend_shop AS shop ON shop.id = product_info.shop_id
+        WHERE item.order_id = %s
+        ORDER BY product_info.id
+        FOR UPDATE OF product_info
+    ), reserved AS (
+        UPDATE backend_productinfo AS product_info SET quantity = product_info.quantity - requested.quantity
+        FROM requested
+        WHERE product_info.id = requested.id AND product_info.quantity >= requested.quantity
+          AND NOT EXISTS (SELECT 1 FROM requested AS shortfall WHERE shortfall.available < shortfall.quantity)
+        RETURNING product_info.id, product_info.quantity
+    ), catalog AS (
+        UPDATE backend_catalogitem AS catalog_item SET quantity = reserved.quantity
+        FROM reserved
+        WHERE catalog_item.id = reserved.id
+    )
+    SELECT requested.item_id, requested.id, requested.quantity, requested.available, reserved.id IS NOT NULL
+    FROM requested LEFT JOIN reserved ON reserved.id = requested.id
+    ORDER BY requested.item_id
+"""
+
+
+class InsufficientStock(Exception):
+    """Товара не хватает для оформления заказа; `shortfalls` - позиции, на которые не хватило остатка."""
+
+    def __init__(self, shortfalls):
+        super().__init__(shortfalls)
+        self.shortfalls = shortfalls
+
+
+def reserve_stock(order_id):
+    """
+    Списывает с остатков предложений количество товара по всем позициям заказа `order_id`.
+    Если товара не хватает хотя бы на одну позицию, остатки не меняются и выбрасывается `InsufficientStock`.
+    Предложения вне опубликованной версии каталога магазина считаются отсутствующими (остаток 0).
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(RESERVE_STOCK_SQL, [order_id])
+        rows = cursor.fetchall()
+    if not all(reserved for *_, reserved in rows):
+        raise InsufficientStock([
+            {'id': item_id, 'product_info': product_info_id, 'quantity': quantity, 'available': available}
+            for item_id, product_info_id, quantity, available, _ in rows if available < quantity
+        ])
+
+
+def checkout_order(user_id, order_id, contact_id):
+    """
+    Оформляет корзину пользователя: задает контакт и статус `new`, фиксирует цены позиций,
+    пересчитывает сумму по ним и резервирует товар. Возвращает число измененных заказов.
+
+    Резервирование выполняется последним, чтобы строки предложений оставались заблокированными
+    только до фиксации транзакции. При нехватке товара транзакция откатывается (`InsufficientStock`).
+    """
+    with transaction.atomic():
+        updated = Order.objects.filter(user_id=user_id, id=order_id, state='basket').update(
+            contact_id=contact_id, state='new')
+        if updated:
+            with connection.cursor() as cursor:
+                cursor.execute(SNAPSHOT_PRICES_SQL, [order_id])
+            update_order_totals([order_id])
+            reserve_stock(order_id)
+    return updated
+
+
+class DatabaseBasketStore:
+    """Хранение корзин в БД: каждое изменение сразу записывается в таблицы заказов."""
+
+    def baskets(self, user_id, context):
+        """Корзины пользователя для вывода `OrderSerializer` с загрузкой связей по контексту полей."""
+        baskets = Order.objects.filter(user_id=user_id, state='basket').prefetch_related('order_items__product_info')
+        return ProductInfoSerializer.load_related(baskets, context, prefix='order_items__product_info__')
+
+    def add(self, user_id, quantities):
+        """Добавляет товары в корзину: `quantities` - ID предложения -> количество. Возвращает число позиций."""
+        basket, _ = Order.objects.get_or_create(user_id=user_id, state='basket')
+        added = add_basket_items(basket.id, quantities)
+        update_order_totals([basket.id])
+        return added
+
+    def update(self, user_id, quantities):
+        """Изменяет количество позиций: `quantities` - ID позиции -> количество. Возвращает ID измененных позиций."""
+        updated = update_basket_items(user_id, quantities)
+        if updated:
+            update_basket_totals(user_id)
+        return updated
+
+    def delete(self, user_id, item_ids):
+        """Удаляет позиции корзины по ID. Возвращает число удаленных позиций."""
+        deleted = OrderItem.objects.filter(order__user_id=user_id, order__state='basket', id__in=item_ids).delete()[0]
+        if deleted:
+            update_basket_totals(user_id)
+        return deleted
+
+    def flush(self, user_ids):
+        """Записывает в БД несохраненные изменения корзин пользователей."""
+
+    def evict(self, user_ids):
+        """Сбрасывает копии корзин пользователей, чтобы они были заново прочитаны из БД."""
+
+    def replace_offers(self, replacements):
+        """
+        Переносит позиции копий корзин с замененных предложений на их новые строки
+        (`replacements` - ID замененного предложения -> ID нового) после публикации каталога.
+        """
+
+
+class CacheBasketStore(DatabaseBasketStore):
+    """
+    Хранение активных корзин в кэше (Redis) с отложенной записью в БД.
+
+    Корзина хранится под ключом пользователя в виде ID заказа, времени создания и списка позиций
+    [ID позиции, ID предложения, количество]; ID заказа и позиций резервируются из последовательностей таблиц,
+    поэтому совпадают с будущими строками БД. Изменения записываются в БД задачей `flush_basket_task`
+    через `settings.BASKET_FLUSH_DELAY` секунд после первого несохраненного изменения и принудительно -
+    перед оформлением заказа (`flush`). После оформления заказа копия в кэше сбрасывается (`evict`).
+
+    Публикация каталога переносит на новые строки предложений только позиции, записанные в БД, а замененные
+    строки затем удаляются. Поэтому замены сохраняются в кэше (`replace_offers`) на время жизни корзин,
+    и позиции копии переносятся на новые строки при каждом чтении корзины (`load`), в том числе перед записью в БД.
+    """
+
+    key = 'basket:{}'
+    flush_key = 'basket:flush:{}'
+    replaced_key = 'basket:replaced:{}'
+
+    def lock(self, user_id):
+        """Блокировка корзины пользователя на время чтения и изменения (доступна в django-redis)."""
+        if hasattr(cache, 'lock'):
+            return cache.lock(f'basket:lock:{user_id}', timeout=10)
+        return nullcontext()
+
+    def load(self, user_id, create=False):
+        """Корзина пользователя из кэша; при отсутствии читается из БД, при `create` - создается."""
+        basket = cache.get(self.key.format(user_id))
+        if basket is None:
+            order = Order.objects.filter(user_id=user_id, state='basket').first()
+            basket = {'id': None, 'created_at': None, 'items': []}
+            if order:
+                basket = {'id': order.id, 'created_at': order.created_at.isoformat(), 'items': [
+                    list(item) for item in OrderItem.objects.filter(order_id=order.id).order_by('id').values_list(
+                        'id', 'product_info_id', 'quantity')]}
+            cache.set(self.key.format(user_id), basket, BASKET_CACHE_TIMEOUT)
+        if basket['id'] is None and create:
+            from backend.importer import allocate_ids
+            basket = {'id': allocate_ids(Order, 1)[0], 'created_at': timezone.now().isoformat(), 'items': []}
+        return self.remap(basket)
+
+    def remap(self, basket):
+        """
+        Переносит позиции корзины с замененных предложений на их новые строки, объединяя совпавшие позиции.
+        Предложение могло быть заменено несколькими публикациями подряд, поэтому замены применяются по цепочке.
+        """
+        product_ids = {product_id for _, product_id, _ in basket['items']}
+        replacements = {}
+        while product_ids:
+            keys = {self.replaced_key.format(product_id): product_id for product_id in product_ids}
+            found = {keys[key]: new_id for key, new_id in cache.get_many(list(keys)).items()}
+            replacements.update(found)
+            product_ids = set(found.values())
+        if not replacements:
+            return basket
+        lines = {}
+        for line in basket['items']:
+            while line[1] in replacements:
+                line[1] = replacements[line[1]]
+            if line[1] in lines:
+                lines[line[1]][2] = min(lines[line[1]][2] + line[2], MAX_QUANTITY)
+            else:
+                lines[line[1]] = line
+        basket['items'] = list(lines.values())
+        return basket
+
+    def save(self, user_id, basket):
+        """Сохраняет корзину в кэш и планирует ее запись в БД, если она еще не запланирована."""
+        from backend.tasks import flush_basket_task
+        cache.set(self.key.format(user_id), basket, BASKET_CACHE_TIMEOUT)
+        # Метка живет дольше задержки: если задача потеряна, запись будет запланирована снова после ее истечения
+        if cache.add(self.flush_key.format(user_id), True, settings.BASKET_FLUSH_DELAY * 10):
+            flush_basket_task.apply_async((user_id,), countdown=settings.BASKET_FLUSH_DELAY)
+
+    def baskets(self, user_id, context):
+        basket = self.load(user_id)
+        if basket['id'] is None:
+            return []
+        offers = ProductInfoSerializer.load_related(
+            ProductInfo.objects.filter(id__in=[product_id for _, product_id, _ in basket['items']]), context
+        ).in_bulk()
+        order = Order(id=basket['id'], user_id=user_id, state='basket', created_at=parse_datetime(basket['created_at']))
+        items = [OrderItem(id=item_id, order_id=order.id, product_info=offers[product_id], quantity=quantity)
+                 for item_id, product_id, quantity in basket['items'] if product_id in offers]
+        # Позиции выводятся так же, как загруженные prefetch_related
+        order._prefetched_objects_cache = {'order_items': items}
+        order.total_sum = sum(item.product_info.price * item.quantity for item in items)
+        order.item_count = len(items)
+        return [order]
+
+    def add(self, user_id, quantities):
+        with self.lock(user_id):
+            basket = self.load(user_id, create=True)
+            lines = {line[1]: line for line in basket['items']}
+            if any(lines[product_id][2] + quantity > MAX_QUANTITY
+                   for product_id, quantity in quantities.items() if product_id in lines):
+                raise ValueError(f'Количество товара в позиции должно быть не более {MAX_QUANTITY}')
+            new = [product_id for product_id in quantities if product_id not in lines]
+            if new:
+                from backend.importer import allocate_ids
+                for item_id, product_id in zip(allocate_ids(OrderItem, len(new)), new):
+                    lines[product_id] = [item_id, product_id, 0]
+                    basket['items'].append(lines[product_id])
+            for product_id, quantity in quantities.items():
+                lines[product_id][2] += quantity
+            self.save(user_id, basket)
+        return len(quantities)
+
+    def update(self, user_id, quantities):
+        with self.lock(user_id):
+            basket = self.load(user_id)
+            updated = []
+            for line in basket['items']:
+                if line[0] in quantities:
+                    line[2] = quantities[line[0]]
+                    updated.append(line[0])
+            if updated:
+                self.save(user_id, basket)
+        return sorted(updated)
+
+    def delete(self, user_id, item_ids):
+        item_ids = set(item_ids)
+        with self.lock(user_id):
+            basket = self.load(user_id)
+            items = [line for line in basket['items'] if line[0] not in item_ids]
+            deleted = len(basket['items']) - len(items)
+            if deleted:
+                basket['items'] = items
+                self.save(user_id, basket)
+        return deleted
+
+    def flush(self, user_ids):
+        for user_id in user_ids:
+            with self.lock(user_id):
+                # Внутри транзакции (пробный импорт) метка снимается только после ее фиксации: при откате
+                # запись корзины в БД отменяется, и запланированная задача должна выполнить ее снова
+                transaction.on_commit(partial(cache.delete, self.flush_key.format(user_id)))
+                basket = cache.get(self.key.format(user_id))
+                if basket and basket['id'] is not None:
+                    self.persist(user_id, self.remap(basket))
+
+    def persist(self, user_id, basket):
+        """Записывает корзину в БД. Позиции, предложения которых уже удалены, не записываются."""
+        existing = set(ProductInfo.objects.filter(
+            id__in=[product_id for _, product_id, _ in basket['items']]).values_list('id', flat=True))
+        with transaction.atomic():
+            order, created = Order.objects.get_or_create(id=basket['id'], defaults={
+                'user_id': user_id, 'state': 'basket'})
+            if order.state != 'basket':
+                return
+            if created:
+                Order.objects.filter(id=order.id).update(created_at=parse_datetime(basket['created_at']))
+            items = [OrderItem(id=item_id, order_id=order.id, product_info_id=product_id, quantity=quantity)
+                     for item_id, product_id, quantity in basket['items'] if product_id in existing]
+            OrderItem.objects.filter(order_id=order.id).exclude(id__in=[item.id for item in items]).delete()
+            OrderItem.objects.bulk_create(items, update_conflicts=True, unique_fields=['id'],
+                                          update_fields=['product_info', 'quantity'])
+            update_order_totals([order.id])
+
+    def evict(self, user_ids):
+        cache.delete_many([self.key.format(user_id) for user_id in user_ids])
+
+    def replace_offers(self, replacements):
+        cache.set_many({self.replaced_key.format(old_id): new_id for old_id, new_id in replacements.items()},
+                       BASKET_CACHE_TIMEOUT)
+
+
+def get_basket_store():
+    """Хранилище корзин, выбранное настройкой `BASKET_STORE`: `database` (по умолчанию) или `cache`."""
+    if settings.BASKET_STORE == 'cache':
+        return CacheBasketStore()
+    return DatabaseBasketStore()
@@ -0,0 +1,89 @@
+import hashlib
+import time
+from functools import partial
+from urllib.parse import urlencode
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+
+# Версия всего каталога и версии каталогов отдельных магазинов
+CATALOG_VERSION_KEY = 'catalog:version'
+SHOP_CATALOG_VERSION_KEY = 'catalog:version:shop:{}'
+# Время хранения ответов каталога в кэше, с
+CATALOG_CACHE_TIMEOUT = 60 * 60
+
+
+def bump_catalog_version(shop_id=None):
+    """
+    Сбрасывает кэш ответов каталога: увеличивает общую версию и версию магазина `shop_id`.
+    Внутри транзакции версия меняется только после ее фиксации.
+    """
+    keys = [CATALOG_VERSION_KEY] + ([SHOP_CATALOG_VERSION_KEY.format(shop_id)] if shop_id else [])
+
+    def bump():
+        for key in keys:
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, time.time_ns(), None)
+
+    transaction.on_commit(bump)
+
+
+class CatalogCacheMixin:
+    """
+    Кэширование ответов на GET-запросы к каталогу.
+
+    Ответ хранится в кэше под ключом из адреса и нормализованных параметров запроса вместе с версией
+    каталога, при которой он построен; запись и версия читаются одним запросом к кэшу, поэтому повторный
+    запрос не обращается к БД. Ответы содержат сильный ETag, по заголовку If-None-Match отдается 304.
+    """
+
+    catalog_cache_timeout = CATALOG_CACHE_TIMEOUT
+
+    def get(self, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return super().get(request, *args, **kwargs)
+
+        key, version_key = self.get_cache_key(request), self.get_catalog_version_key(request)
+        cached = cache.get_many([key, version_key])
+        version = cached.get(version_key)
+        if version is None:
+            # Новое значение, а не 0: после вытеснения ключа версии старые записи не должны стать актуальными
+            cache.add(version_key, time.time_ns(), None)
+            version = cache.get(version_key)
+        entry = cached.get(key)
+        if entry and entry['version'] == version:
+            if self.etag_matches(request, entry['etag']):
+                return HttpResponseNotModified(headers={'ETag': entry['etag']})
+            return HttpResponse(entry['content'], content_type=entry['content_type'], headers={'ETag': entry['etag']})
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            response.add_post_render_callback(partial(self.cache_response, request, key, version))
+        return response
+
+    def get_catalog_version_key(self, request):
+        """Ключ версии каталога, от которой зависит ответ."""
+        return CATALOG_VERSION_KEY
+
+    @staticmethod
+    def get_cache_key(request):
+        params = sorted((name, sorted(values)) for name, values in request.query_params.lists())
+        url = request.build_absolute_uri(request.path) + '?' + urlencode(params, doseq=True)
+        return 'catalog:response:' + hashlib.sha256(url.encode()).hexdigest()
+
+    @staticmethod
+    def etag_matches(request, etag):
+        etags = parse_etags(request.headers.get('If-None-Match', ''))
+        return '*' in etags or etag in etags
+
+    def cache_response(self, request, key, version, response):
+        etag = quote_etag(hashlib.sha256(response.content).hexdigest())
+        cache.set(key, {'version': version, 'etag': etag, 'content': response.content,
+                        'content_type': response['Content-Type']}, self.catalog_cache_timeout)
+        if self.etag_matches(request, etag):
+            return HttpResponseNotModified(headers={'ETag': etag})
+        response['ETag'] = etag
+        return response
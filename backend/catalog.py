@@ -0,0 +1,57 @@
+from django.db import connection, transaction
+from django.db.models import Func, JSONField
+from backend.models import Shop, ProductInfo, CatalogItem
+from backend.cache import bump_catalog_version
+
+# Добавляет в каталог опубликованные предложения, которых в нем еще нет
+INSERT_CATALOG_ITEMS_SQL = """
+    INSERT INTO backend_catalogitem (id, shop_id, shop_name, shop_state, product_id, product_name, category_id,
+                                     category_name, model, ext_id, quantity, price, price_rrc, parameters,
+                                     search_vector)
+    SELECT product_info.id, shop.id, shop.name, shop.state, product.id, product.name, category.id, category.name,
+           product_info.model, product_info.ext_id, product_info.quantity, product_info.price, product_info.price_rrc,
+           coalesce((
+               SELECT jsonb_object_agg(parameter.name, product_parameter.value)
+               FROM backend_productparameter AS product_parameter
+               JOIN backend_parameter AS parameter ON parameter.id = product_parameter.parameter_id
+               WHERE product_parameter.product_info_id = product_info.id
+           ), '{}'::jsonb),
+           product_info.search_vector
+    FROM backend_productinfo AS product_info
+    JOIN backend_shop AS shop ON shop.id = product_info.shop_id
+    JOIN backend_product AS product ON product.id = product_info.product_id
+    JOIN backend_category AS category ON category.id = product.category_id
+    WHERE product_info.version <= shop.catalog_version
+      AND (product_info.retired_version IS NULL OR product_info.retired_version > shop.catalog_version)
+      AND NOT EXISTS (SELECT 1 FROM backend_catalogitem AS item WHERE item.id = product_info.id)
+"""
+
+
+class ParameterList(Func):
+    """
+    Параметры записи каталога списком объектов {"parameter": название, "value": значение}, как их выводит
+    `CatalogItemSerializer`. Список собирается в БД (json сохраняет порядок ключей, в отличие от jsonb)
+    и передается текстом, который разбирается JSONField.
+    """
+    template = ("(SELECT coalesce(json_agg(json_build_object('parameter', parameter.key, 'value', parameter.value)), "
+                "'[]')::text FROM jsonb_each_text(%(expressions)s) AS parameter)")
+    output_field = JSONField()
+
+
+def refresh_catalog(shop_id):
+    """
+    Приводит записи каталога магазина в соответствие с опубликованной версией его предложений.
+
+    Обновление инкрементальное: строки предложений неизменны (изменения записываются новыми строками),
+    поэтому удаляются только записи снятых и замененных предложений и добавляются только новые.
+    После фиксации изменений сбрасывается кэш ответов каталога.
+    """
+    shop = Shop.objects.get(id=shop_id)
+    with transaction.atomic():
+        CatalogItem.objects.filter(shop_id=shop_id).exclude(
+            id__in=ProductInfo.objects.published().filter(shop_id=shop_id).values('id')).delete()
+        CatalogItem.objects.filter(shop_id=shop_id).exclude(shop_name=shop.name, shop_state=shop.state).update(
+            shop_name=shop.name, shop_state=shop.state)
+        with connection.cursor() as cursor:
+            cursor.execute(INSERT_CATALOG_ITEMS_SQL + ' AND product_info.shop_id = %s', [shop_id])
+        bump_catalog_version(shop_id)
@@ -0,0 +1,55 @@
+import csv
+import io
+import json
+import zlib
+
+# Число записей каталога, читаемых серверным курсором за раз
+EXPORT_CHUNK_SIZE = 2000
+
+# Колонки выгрузки каталога в CSV
+CSV_FIELDS = ('id', 'shop_id', 'shop_name', 'category_id', 'category_name', 'product_id', 'product_name', 'model',
+              'ext_id', 'quantity', 'price', 'price_rrc', 'parameters')
+
+
+def chunk_rows(rows, chunk_size=EXPORT_CHUNK_SIZE):
+    """Объединяет строки выгрузки в блоки, чтобы не отдавать ответ слишком мелкими частями."""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield ''.join(chunk).encode()
+            chunk = []
+    if chunk:
+        yield ''.join(chunk).encode()
+
+
+def ndjson_rows(queryset, serializer_class, context, chunk_size=EXPORT_CHUNK_SIZE):
+    """Записи каталога в формате NDJSON: по одному JSON-объекту на строку."""
+    for item in queryset.iterator(chunk_size=chunk_size):
+        yield json.dumps(serializer_class(item, context=context).data, ensure_ascii=False) + '\n'
+
+
+def csv_rows(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """Записи каталога в формате CSV с заголовком; параметры товара выводятся одной колонкой в JSON."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def row(values):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(values)
+        return buffer.getvalue()
+
+    yield row(CSV_FIELDS)
+    for values in queryset.values_list(*CSV_FIELDS).iterator(chunk_size=chunk_size):
+        yield row(values[:-1] + (json.dumps(values[-1], ensure_ascii=False),))
+
+
+def gzip_stream(chunks):
+    """Сжимает поток блоков в gzip по мере их поступления."""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,464 @@
+import csv
+import io
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from functools import partial
+from itertools import islice
+from django.db import connection, transaction
+from django.db.models import Count
+from cachalot.api import invalidate
+from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, \
+    ParameterFacet
+from backend.price_list import PriceList
+from backend.search import update_search_vectors
+from backend.catalog import refresh_catalog
+from backend.basket import get_basket_store, update_order_totals
+
+# Количество товаров, обрабатываемых за один пакет запросов
+BATCH_SIZE = 1000
+
+
+def chunked(iterable, size):
+    """Разбивает последовательность на списки длиной не более `size`."""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def allocate_ids(model, count):
+    """Резервирует `count` значений первичного ключа из последовательности таблицы модели."""
+    if not count:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+                       [model._meta.db_table, model._meta.pk.column, count])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def copy_rows(model, fields, rows):
+    """Записывает строки в таблицу модели командой COPY FROM STDIN в формате CSV."""
+    if not rows:
+        return
+    buffer = io.StringIO()
+    # Все значения в кавычках: иначе пустая строка будет прочитана как NULL
+    csv.writer(buffer, quoting=csv.QUOTE_ALL).writerows(rows)
+    buffer.seek(0)
+    quote_name = connection.ops.quote_name
+    columns = ', '.join(quote_name(model._meta.get_field(field).column) for field in fields)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f'COPY {quote_name(model._meta.db_table)} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+class ImportProfiler:
+    """
+    Сбор статистики импорта по этапам: время, число SQL-запросов, прочитанные и записанные строки,
+    пиковый объем памяти, выделенной Python (tracemalloc).
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.current = None
+        self.started_tracing = False
+
+    @contextmanager
+    def profile(self):
+        """Включает подсчет запросов и памяти на время всего импорта."""
+        self.started_tracing = not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+        try:
+            with connection.execute_wrapper(self.count_query):
+                with self.phase('total'):
+                    yield self
+        finally:
+            if self.started_tracing:
+                tracemalloc.stop()
+
+    @contextmanager
+    def phase(self, name):
+        """Относит время, запросы и память внутри блока к этапу `name`."""
+        stats = self.phases.setdefault(name, {'time': 0.0, 'queries': 0, 'rows_read': 0, 'rows_written': 0,
+                                              'peak_memory': 0})
+        parent, self.current = self.current, stats
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats['time'] += time.perf_counter() - started
+            stats['peak_memory'] = max(stats['peak_memory'], tracemalloc.get_traced_memory()[1])
+            self.current = parent
+            if parent is not None:
+                parent['peak_memory'] = max(parent['peak_memory'], stats['peak_memory'])
+
+    def count_query(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        rowcount = max(context['cursor'].rowcount, 0)
+        total = self.phases['total']
+        for stats in (total,) if self.current is total else (total, self.current):
+            stats['queries'] += 1
+            if sql.lstrip().upper().startswith('SELECT'):
+                stats['rows_read'] += rowcount
+            else:
+                stats['rows_written'] += rowcount
+        return result
+
+    def report(self):
+        return {name: {**stats, 'time': round(stats['time'], 4)} for name, stats in self.phases.items()}
+
+
+class CatalogImporter:
+    """
+    Загрузка прайс-листа магазина в каталог.
+
+    Категории, продукты и параметры сопоставляются по названию через словари name -> id,
+    которые заполняются одним запросом на пакет товаров, а новые записи создаются через `bulk_create`.
+    Число запросов зависит от количества пакетов, а не от количества товаров и их параметров.
+
+    Товары принимаются любым итерируемым объектом и обрабатываются пакетами по `batch_size`,
+    поэтому прайс-лист может читаться потоково, не загружаясь в память целиком.
+
+    Предложения магазина сравниваются с уже загруженными по артикулу (ext_id): записываются только
+    новые и изменившиеся строки, а отсутствующие в прайсе снимаются с продажи.
+
+    Импорт собирает следующую версию каталога магазина, не затрагивая опубликованную: новые
+    и изменившиеся предложения записываются отдельными строками с номером новой версии, а заменяемые
+    и снятые - помечаются номером версии, в которой они перестают действовать. Каждый пакет записывается
+    в короткой транзакции, а в конце версия публикуется одним обновлением `Shop.catalog_version`,
+    поэтому покупатели (см. `ProductInfo.objects.published()`) видят либо старый, либо новый каталог целиком.
+    Недописанная после сбоя версия удаляется при следующем импорте, поэтому импорт держит блокировку
+    магазина (см. `lock`) и параллельный импорт того же магазина завершается ошибкой. Денормализованный каталог
+    (`backend.catalog`) обновляется в той же транзакции, что и версия, а после публикации
+    пересчитываются фасеты параметров.
+
+    С параметром `copy` новые предложения и их параметры записываются командой COPY FROM STDIN:
+    идентификаторы предложений заранее резервируются в последовательности таблицы.
+    """
+
+    # Поля предложения, изменение которых требует обновления строки
+    offer_fields = ('product_id', 'model', 'quantity', 'price', 'price_rrc')
+
+    def __init__(self, shop, batch_size=BATCH_SIZE, progress=None, profiler=None, copy=False):
+        self.shop = shop
+        self.batch_size = batch_size
+        # Загрузка новых строк командой COPY вместо INSERT (только PostgreSQL)
+        self.copy = copy and connection.vendor == 'postgresql'
+        # Функция, вызываемая со статистикой после каждого пакета товаров
+        self.progress = progress
+        # ImportProfiler для сбора статистики по этапам импорта
+        self.profiler = profiler
+        # (category_id, name) -> product_id
+        self.products = {}
+        # name -> parameter_id
+        self.parameters = {}
+        # Категории, уже привязанные к магазину в ходе импорта
+        self.category_ids = set()
+        # ext_id -> текущие значения предложения магазина
+        self.offers = {}
+        # Собираемая версия каталога магазина
+        self.version = None
+        # id замененного предложения -> id предложения новой версии
+        self.replacements = {}
+        self.stats = {'categories': 0, 'parameters': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'removed': 0}
+
+    def run(self, price_list):
+        """
+        Загружает категории и товары прайс-листа (см. `backend.price_list`) в новую версию каталога
+        и публикует ее.
+        """
+        with self.lock():
+            return self.import_version(price_list)
+
+    @contextmanager
+    def lock(self):
+        """
+        Держит рекомендательную блокировку PostgreSQL по id магазина на время импорта.
+        Если блокировка уже занята другим импортом, выбрасывается `ValueError`.
+        Внутри общей транзакции (пробный запуск) блокировка снимается вместе с ее откатом.
+        """
+        if connection.vendor != 'postgresql':
+            yield
+            return
+        in_transaction = connection.in_atomic_block
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT pg_try_advisory{'_xact' if in_transaction else ''}_lock(%s)", [self.shop.id])
+            if not cursor.fetchone()[0]:
+                raise ValueError('Каталог магазина уже загружается другим импортом')
+        if in_transaction:
+            yield
+            return
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', [self.shop.id])
+
+    def import_version(self, price_list):
+        with self.phase('load_offers'):
+            self.discard_staged()
+            self.load_offers()
+        with self.phase('categories'):
+            self.import_categories(price_list.categories)
+        chunks = chunked(price_list.goods(), self.batch_size)
+        while True:
+            with self.phase('parse'):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            with transaction.atomic():
+                # Потоковые форматы могут находить новые категории по мере чтения товаров
+                with self.phase('categories'):
+                    self.import_categories(price_list.categories)
+                self.import_goods(chunk)
+            if self.progress:
+                self.progress(self.stats)
+        with self.phase('categories'):
+            self.import_categories(price_list.categories)
+        with self.phase('retire'):
+            self.retire_offers()
+        with self.phase('publish'):
+            self.publish()
+        with self.phase('facets'):
+            self.refresh_facets()
+        with self.phase('cleanup'):
+            self.delete_retired()
+        self.stats['version'] = self.version
+        if self.copy:
+            # COPY выполняется в обход ORM, поэтому кэш запросов cachalot сбрасывается явно
+            invalidate(ProductInfo, ProductParameter)
+        return self.stats
+
+    def phase(self, name):
+        return self.profiler.phase(name) if self.profiler else nullcontext()
+
+    def import_categories(self, categories):
+        """Создает недостающие категории и привязывает их к магазину."""
+        categories = [category for category in categories if category['id'] not in self.category_ids]
+        if not categories:
+            return
+        Category.objects.bulk_create(
+            [Category(id=category['id'], name=category['name']) for category in categories],
+            ignore_conflicts=True,
+        )
+        Category.shops.through.objects.bulk_create(
+            [Category.shops.through(category_id=category['id'], shop_id=self.shop.id) for category in categories],
+            ignore_conflicts=True,
+        )
+        self.category_ids.update(category['id'] for category in categories)
+        self.stats['categories'] += len(categories)
+
+    def discard_staged(self):
+        """Удаляет остатки неопубликованной версии каталога, например после сбоя импорта."""
+        published = Shop.objects.filter(id=self.shop.id).values_list('catalog_version', flat=True).get()
+        with transaction.atomic():
+            ProductInfo.objects.filter(shop_id=self.shop.id, version__gt=published).delete()
+            ProductInfo.objects.filter(shop_id=self.shop.id, retired_version__gt=published).update(retired_version=None)
+        self.version = published + 1
+
+    def load_offers(self):
+        """Загружает текущие предложения магазина одним запросом."""
+        rows = ProductInfo.objects.filter(shop_id=self.shop.id, retired_version=None).values_list(
+            'ext_id', 'id', *self.offer_fields)
+        self.offers = {ext_id: values for ext_id, *values in rows}
+
+    def import_goods(self, goods):
+        """Загружает пакет товаров: продукты, предложения магазина и их параметры."""
+        # Продукты редко повторяются между пакетами, поэтому словарь не копится на весь прайс-лист
+        self.products = {}
+        with self.phase('products'):
+            self.resolve_products(goods)
+        with self.phase('parameters'):
+            self.resolve_parameters(goods)
+        with self.phase('diff'):
+            created, changed = self.diff_goods(goods)
+        with self.phase('write'):
+            self.write_goods(created, changed)
+
+    def diff_goods(self, goods):
+        """
+        Делит пакет товаров на новые предложения и изменившиеся (в полях или параметрах).
+        Для изменившихся предложений возвращаются пары (id заменяемой строки, предложение и товар).
+        """
+        created, matched = [], {}
+        for item in goods:
+            offer = ProductInfo(product_id=self.products[(item['category'], item['name'])],
+                                shop_id=self.shop.id,
+                                model=item['model'],
+                                ext_id=item['id'],
+                                quantity=item['quantity'],
+                                price=item['price'],
+                                price_rrc=item['price_rrc'],
+                                version=self.version)
+            current = self.offers.pop(offer.ext_id, None)
+            if current is None:
+                created.append((offer, item))
+            else:
+                offer.id, *current = current
+                matched[offer.id] = (offer, item, current)
+
+        current_parameters = defaultdict(dict)
+        for product_info_id, parameter_id, value in ProductParameter.objects.filter(
+                product_info_id__in=list(matched)).values_list('product_info_id', 'parameter_id', 'value'):
+            current_parameters[product_info_id][parameter_id] = value
+
+        changed = []
+        for offer, item, current in matched.values():
+            if (any(getattr(offer, field) != value for field, value in zip(self.offer_fields, current))
+                    or current_parameters[offer.id] != self.item_parameters(item)):
+                changed.append((offer.id, (offer, item)))
+                offer.id = None
+        self.stats['updated'] += len(changed)
+        self.stats['unchanged'] += len(matched) - len(changed)
+        return created, changed
+
+    def write_goods(self, created, changed):
+        """
+        Записывает новые предложения и новые строки изменившихся предложений вместе с параметрами,
+        а заменяемые строки помечает номером собираемой версии.
+        """
+        ProductInfo.objects.filter(id__in=[product_info_id for product_info_id, _ in changed]).update(
+            retired_version=self.version)
+        created = created + [goods for _, goods in changed]
+        offers = [offer for offer, _ in created]
+        if self.copy:
+            for offer, product_info_id in zip(offers, allocate_ids(ProductInfo, len(offers))):
+                offer.id = product_info_id
+            copy_rows(ProductInfo, ('id', 'product_id', 'shop_id', 'model', 'ext_id', 'quantity', 'price', 'price_rrc',
+                                    'version'),
+                      [(offer.id, offer.product_id, offer.shop_id, offer.model, offer.ext_id, offer.quantity,
+                        offer.price, offer.price_rrc, offer.version) for offer in offers])
+        else:
+            ProductInfo.objects.bulk_create(offers)
+        self.replacements.update((product_info_id, offer.id) for product_info_id, (offer, _) in changed)
+        parameters = [
+            (offer.id, parameter_id, value)
+            for offer, item in created
+            for parameter_id, value in self.item_parameters(item).items()
+        ]
+        if self.copy:
+            copy_rows(ProductParameter, ('product_info_id', 'parameter_id', 'value'), parameters)
+        else:
+            ProductParameter.objects.bulk_create([
+                ProductParameter(product_info_id=product_info_id, parameter_id=parameter_id, value=value)
+                for product_info_id, parameter_id, value in parameters
+            ])
+        update_search_vectors([offer.id for offer in offers])
+        self.stats['inserted'] += len(created) - len(changed)
+
+    def retire_offers(self):
+        """Помечает предложения, которых нет в новом прайсе, как снятые в собираемой версии."""
+        missing = [values[0] for values in self.offers.values()]
+        for ids in chunked(missing, self.batch_size):
+            ProductInfo.objects.filter(id__in=ids).update(retired_version=self.version)
+        self.stats['removed'] += len(missing)
+        self.offers = {}
+
+    def publish(self):
+        """
+        Публикует собранную версию каталога одной короткой транзакцией вместе с обновлением
+        денормализованного каталога, чтобы список товаров и проверка корзины переключались одновременно.
+        Позиции корзин переносятся с замененных предложений на их новые строки; корзины, хранящиеся в кэше,
+        записываются в БД до переноса, а после фиксации публикации замены передаются хранилищу корзин,
+        чтобы перенести и еще не записанные позиции копий в кэше.
+        Остаток снятых предложений, на которые ссылаются заказы и корзины, обнуляется.
+        """
+        basket_store = get_basket_store()
+        users = list(Order.objects.filter(
+            state='basket', order_items__product_info__shop_id=self.shop.id,
+            order_items__product_info__retired_version=self.version).values_list('user_id', flat=True).distinct())
+        basket_store.flush(users)
+        with transaction.atomic():
+            if not Shop.objects.filter(id=self.shop.id, catalog_version=self.version - 1).update(
+                    catalog_version=self.version):
+                raise ValueError('Каталог магазина был опубликован параллельной загрузкой')
+            items = list(OrderItem.objects.filter(order__state='basket', product_info__shop_id=self.shop.id,
+                                                  product_info__retired_version=self.version).only(
+                'order_id', 'product_info_id'))
+            for item in items:
+                item.product_info_id = self.replacements.get(item.product_info_id, item.product_info_id)
+            OrderItem.objects.bulk_update(items, ['product_info_id'], batch_size=self.batch_size)
+            if self.stats['removed'] or self.replacements:
+                ProductInfo.objects.filter(shop_id=self.shop.id, retired_version=self.version,
+                                           id__in=OrderItem.objects.values('product_info_id')).exclude(
+                    quantity=0).update(quantity=0)
+            # Суммы корзин считаются по текущим ценам предложений
+            update_order_totals({item.order_id for item in items})
+            with self.phase('catalog'):
+                refresh_catalog(self.shop.id)
+            # При откате (пробный запуск) копии корзин в кэше не меняются
+            if self.replacements:
+                transaction.on_commit(partial(basket_store.replace_offers, self.replacements))
+        self.shop.catalog_version = self.version
+        self.replacements = {}
+
+    def refresh_facets(self):
+        """Пересчитывает фасеты параметров опубликованного каталога магазина."""
+        counts = ProductParameter.objects.filter(
+            product_info__in=ProductInfo.objects.published().filter(shop_id=self.shop.id).values('id')
+        ).values_list('product_info__product__category_id', 'parameter_id', 'value').annotate(
+            count=Count('id')).order_by()
+        with transaction.atomic():
+            ParameterFacet.objects.filter(shop_id=self.shop.id).delete()
+            ParameterFacet.objects.bulk_create([
+                ParameterFacet(shop_id=self.shop.id, category_id=category_id, parameter_id=parameter_id, value=value,
+                               count=count)
+                for category_id, parameter_id, value, count in counts
+            ], batch_size=self.batch_size)
+
+    def delete_retired(self):
+        """Удаляет снятые предложения опубликованных версий, на которые не ссылаются заказы и корзины."""
+        retired = ProductInfo.objects.filter(shop_id=self.shop.id, retired_version__lte=self.version).exclude(
+            id__in=OrderItem.objects.values('product_info_id')).values_list('id', flat=True)
+        for ids in chunked(retired, self.batch_size):
+            with transaction.atomic():
+                ProductInfo.objects.filter(id__in=ids).delete()
+
+    def item_parameters(self, item):
+        """Параметры товара в виде parameter_id -> значение, как они хранятся в БД."""
+        return {self.parameters[name]: str(value) for name, value in item['parameters'].items()}
+
+    def resolve_products(self, goods):
+        """Заполняет словарь продуктов, создавая отсутствующие в БД."""
+        keys = {(item['category'], item['name']) for item in goods} - self.products.keys()
+        if not keys:
+            return
+        existing = Product.objects.filter(name__in={name for _, name in keys}).values_list('category_id', 'name', 'id')
+        for category_id, name, product_id in existing:
+            if (category_id, name) in keys:
+                self.products.setdefault((category_id, name), product_id)
+        missing = keys - self.products.keys()
+        if missing:
+            # Продукты общие для магазинов и могут создаваться параллельным импортом, поэтому после вставки
+            # идентификаторы перечитываются
+            Product.objects.bulk_create([Product(category_id=category_id, name=name)
+                                         for category_id, name in missing], ignore_conflicts=True)
+            for category_id, name, product_id in Product.objects.filter(
+                    name__in={name for _, name in missing}).values_list('category_id', 'name', 'id'):
+                if (category_id, name) in missing:
+                    self.products[(category_id, name)] = product_id
+
+    def resolve_parameters(self, goods):
+        """Заполняет словарь параметров, создавая отсутствующие в БД."""
+        names = {name for item in goods for name in item['parameters']} - self.parameters.keys()
+        if not names:
+            return
+        self.parameters.update(Parameter.objects.filter(name__in=names).values_list('name', 'id'))
+        missing = names - self.parameters.keys()
+        if missing:
+            # Параметр мог быть создан параллельным импортом, поэтому после вставки идентификаторы перечитываются
+            Parameter.objects.bulk_create([Parameter(name=name) for name in missing], ignore_conflicts=True)
+            self.parameters.update(Parameter.objects.filter(name__in=missing).values_list('name', 'id'))
+            self.stats['parameters'] += len(missing)
+
+
+def import_catalog(shop, data, **kwargs):
+    """Загружает прайс-лист `data` (shop/categories/goods) в каталог магазина `shop`."""
+    return import_price_list(shop, PriceList(data), **kwargs)
+
+
+def import_price_list(shop, price_list, **kwargs):
+    """Загружает прайс-лист (см. `backend.price_list`) в каталог магазина `shop`."""
+    importer = CatalogImporter(shop, **kwargs)
+    return importer.run(price_list)
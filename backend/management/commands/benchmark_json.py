@@ -0,0 +1,57 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from backend.models import CatalogItem
+from backend.pagination import KeysetPagination
+from backend.renderers import UJSONRenderer
+from backend.serializers import CatalogItemSerializer
+
+
+def measure(render, data, repeat):
+    """Лучшее время из `repeat` кодирований `data`, с."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        render(data)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость кодирования ответа /products стандартным JSON renderer и ujson.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=KeysetPagination.max_page_size,
+            help='Количество товаров в ответе.'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Количество повторов; выводится лучшее время.'
+        )
+
+    def handle(self, *args, **options):
+        items = CatalogItem.objects.filter(shop_state=True).defer('search_vector').order_by('id')
+        data = {'next': None, 'previous': None,
+                'results': CatalogItemSerializer(items[:options['page_size']], many=True).data}
+        if not data['results']:
+            raise CommandError('Каталог пуст: загрузите товары перед замером')
+
+        results = {}
+        for renderer_class in (JSONRenderer, UJSONRenderer):
+            renderer = renderer_class()
+            content = renderer.render(data)
+            results[renderer_class.__name__] = content, measure(renderer.render, data, max(1, options['repeat']))
+        (standard, standard_time), (fast, fast_time) = results.values()
+        if standard != fast:
+            raise CommandError('Вывод renderer\'ов отличается')
+
+        self.stdout.write(f"Товаров: {len(data['results'])}, размер ответа: {len(fast) / 2 ** 10:.1f} КБ")
+        for name, (_, elapsed) in results.items():
+            self.stdout.write(f"  {name:<14} {elapsed * 1000:>8.2f} мс")
+        self.stdout.write(f"Ускорение: {standard_time / fast_time:.1f}x")
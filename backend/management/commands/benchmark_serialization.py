@@ -0,0 +1,75 @@
+import gc
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.serializers import ListSerializer
+from backend.models import CatalogItem
+from backend.pagination import KeysetPagination
+from backend.serializers import CatalogItemSerializer
+
+
+def measure(build, repeat):
+    """Лучшее время из `repeat` построений вывода и сам вывод; сборщик мусора на время замера отключается."""
+    best, result = None, None
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = build()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        gc.enable()
+    return result, best
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает скорость построения страницы /products: полями DRF по объектам моделей, '
+            'быстрым путем по объектам и по строкам values().')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=KeysetPagination.max_page_size,
+            help='Количество товаров на странице.'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Количество повторов; выводится лучшее время.'
+        )
+
+    def handle(self, *args, **options):
+        page_size, repeat = options['page_size'], max(1, options['repeat'])
+        items = CatalogItem.objects.filter(shop_state=True).defer('search_vector').order_by('id')[:page_size]
+        serializer = CatalogItemSerializer()
+        columns, represent = serializer.values_representation()
+        rows_query = CatalogItemSerializer.annotate_values(items, columns)
+        rows = list(rows_query.values(*columns))
+        if not rows:
+            raise CommandError('Каталог пуст: загрузите товары перед замером')
+        instances = list(items)
+
+        # Только построение вывода по уже прочитанным данным и вместе с чтением страницы из БД
+        cases = {
+            'DRF': (lambda: ListSerializer.to_representation(CatalogItemSerializer(many=True), instances),
+                    lambda: ListSerializer.to_representation(CatalogItemSerializer(many=True), list(items.all()))),
+            'объекты': (lambda: CatalogItemSerializer(instances, many=True).data,
+                        lambda: CatalogItemSerializer(list(items.all()), many=True).data),
+            'values()': (lambda: list(map(represent, rows)),
+                         lambda: list(map(represent, rows_query.values(*columns)))),
+        }
+        results = {name: [measure(build, repeat) for build in builds] for name, builds in cases.items()}
+        outputs = {json.dumps(output) for measurements in results.values() for output, _ in measurements}
+        if len(outputs) != 1:
+            raise CommandError('Вывод способов сериализации отличается')
+
+        self.stdout.write(f"Товаров: {len(rows)}")
+        self.stdout.write(f"  {'способ':<10} {'вывод, мс':>10} {'с БД, мс':>10} {'ускорение':>10}")
+        (_, base), (_, base_total) = results['DRF']
+        for name, ((_, elapsed), (_, total)) in results.items():
+            self.stdout.write(f"  {name:<10} {elapsed * 1000:>10.2f} {total * 1000:>10.2f} "
+                              f"{base / elapsed:>5.1f}x/{base_total / total:.1f}x")
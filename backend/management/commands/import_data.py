@@ -1,41 +1,146 @@
-from django.core.management.base import BaseCommand
-from backend.models import Shop, Parameter, Category, ProductInfo, Product, ProductParameter
-from yaml import safe_load
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from backend.models import Shop
+from backend.importer import import_price_list, ImportProfiler
+from backend.price_list import open_price_list, EXTENSIONS
+
+
+def import_file(file_path, dry_run=False, profile=False, copy=False):
+    """
+    Загружает один файл прайс-листа и возвращает сводку по нему.
+    При `dry_run` все изменения откатываются, при `profile` в сводку добавляется статистика по этапам,
+    при `copy` новые строки записываются командой COPY.
+    """
+    started = time.perf_counter()
+    profiler = ImportProfiler() if profile or dry_run else None
+    stats = {}
+    # Импорт сам публикует каталог короткими транзакциями; общая транзакция нужна только для отката
+    with open(file_path, 'rb') as file, transaction.atomic() if dry_run else nullcontext():
+        price_list = open_price_list(file, name=file_path)
+        if price_list.shop:
+            with profiler.profile() if profiler else nullcontext():
+                shop, _ = Shop.objects.get_or_create(name=price_list.shop)
+                stats = import_price_list(shop, price_list, profiler=profiler, copy=copy)
+            if profiler:
+                stats['profile'] = profiler.report()
+        if dry_run:
+            transaction.set_rollback(True)
+    return {'file': file_path, 'shop': price_list.shop, 'time': time.perf_counter() - started, **stats}
+
+
+def init_worker():
+    """Подготавливает процесс пула: каждый процесс открывает собственное соединение с БД."""
+    django.setup()
+    connections.close_all()
+
+
+def find_files(paths):
+    """Раскрывает список файлов, каталогов и шаблонов glob в список файлов прайс-листов."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if os.path.splitext(name.removesuffix('.gz'))[1].lower() in EXTENSIONS
+            ))
+        elif glob.has_magic(path):
+            files.extend(sorted(glob.glob(path)))
+        else:
+            files.append(path)
+    return list(dict.fromkeys(files))
 
 
 class Command(BaseCommand):
-    help = 'Загружает данные в БД из указанного файла.'
+    help = 'Загружает данные в БД из указанных файлов.'
 
     def add_arguments(self, parser):
         parser.add_argument(
-            'file_path',  # Name of the argument
+            'paths',  # Name of the argument
+            nargs='+',
             type=str,  # Expected type of the argument
-            help='Путь к файлу.'
+            help='Пути к файлам (YAML, JSON Lines или CSV, в том числе сжатым gzip), каталогам или шаблоны glob.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Выполнить загрузку в транзакции, которая будет откачена, и вывести статистику по этапам.'
+        )
+        parser.add_argument(
+            '--profile',
+            action='store_true',
+            help='Вывести время, число SQL-запросов, затронутые строки и пиковую память по этапам загрузки.'
+        )
+        parser.add_argument(
+            '--copy',
+            action='store_true',
+            help='Записывать новые товары и параметры командой COPY (PostgreSQL), для больших первичных загрузок.'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Количество параллельных процессов загрузки.'
         )
 
     def handle(self, *args, **options):
 
-        file_path = options['file_path']
-        with open(file_path, 'r', encoding='utf-8') as file:
-            data = safe_load(file)
-        if data:
-            shop, _ = Shop.objects.get_or_create(name=data['shop'])
-            for category in data['categories']:
-                new_category, _ = Category.objects.get_or_create(id=category['id'], name=category['name'])
-                new_category.shops.add(shop.id)
-                new_category.save()
-            ProductInfo.objects.filter(shop_id=shop.id).delete()
-            for item in data['goods']:
-                product, _ = Product.objects.get_or_create(category_id=item['category'], name=item['name'])
-                product_info = ProductInfo.objects.create(product_id=product.id,
-                                                          shop_id=shop.id,
-                                                          model=item['model'],
-                                                          ext_id=item['id'],
-                                                          quantity=item['quantity'],
-                                                          price=item['price'],
-                                                          price_rrc=item['price_rrc'])
-                for name, value in item['parameters'].items():
-                    parameter, created = Parameter.objects.get_or_create(name=name)
-                    ProductParameter.objects.create(parameter_id=parameter.id,
-                                                    product_info_id=product_info.id,
-                                                    value=value)
+        files = find_files(options['paths'])
+        if not files:
+            raise CommandError('Не найдено ни одного файла для загрузки')
+        workers = max(1, min(options['workers'] or 1, len(files)))
+
+        started = time.perf_counter()
+        failed = 0
+        dry_run = options['dry_run']
+        import_options = {'dry_run': dry_run, 'profile': options['profile'], 'copy': options['copy']}
+        for file_path, result, error in self.run_imports(files, workers, **import_options):
+            if error:
+                failed += 1
+                self.stderr.write(f"{file_path}: ошибка загрузки - {error}")
+            elif result.get('shop'):
+                self.stdout.write(f"{file_path}: магазин {result['shop']}, добавлено {result['inserted']}, "
+                                  f"обновлено {result['updated']}, без изменений {result['unchanged']}, "
+                                  f"снято с продажи {result['removed']} за {result['time']:.2f} с")
+            else:
+                self.stdout.write(f"{file_path}: пустой прайс-лист")
+            if result and 'profile' in result:
+                self.write_profile(result['profile'])
+        self.stdout.write(f"Загружено файлов: {len(files) - failed} из {len(files)} "
+                          f"за {time.perf_counter() - started:.2f} с")
+        if dry_run:
+            self.stdout.write('Пробный запуск: изменения откачены')
+        if failed:
+            raise CommandError(f'Не удалось загрузить файлов: {failed}')
+
+    def write_profile(self, profile):
+        self.stdout.write(f"  {'этап':<12} {'время, с':>10} {'запросы':>8} {'прочитано':>10} "
+                          f"{'записано':>10} {'память, МБ':>11}")
+        for name, stats in profile.items():
+            self.stdout.write(f"  {name:<12} {stats['time']:>10.3f} {stats['queries']:>8} {stats['rows_read']:>10} "
+                              f"{stats['rows_written']:>10} {stats['peak_memory'] / 2 ** 20:>11.2f}")
+
+    def run_imports(self, files, workers, **import_options):
+        """Загружает файлы последовательно или в пуле процессов; каждый магазин - в своей транзакции."""
+        if workers == 1:
+            for file_path in files:
+                try:
+                    yield file_path, import_file(file_path, **import_options), None
+                except Exception as e:
+                    yield file_path, None, e
+            return
+
+        # Дочерние процессы не должны наследовать открытые соединения родителя
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            futures = {executor.submit(import_file, file_path, **import_options): file_path for file_path in files}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as e:
+                    yield futures[future], None, e
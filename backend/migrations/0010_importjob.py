@@ -0,0 +1,37 @@
+# Generated by Django 5.2.2 on 2026-10-18 03:24
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0009_alter_emailverificationtoken_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('url', models.URLField(verbose_name='Ссылка на прайс-лист')),
+                ('phase', models.CharField(choices=[('queued', 'В очереди'), ('downloading', 'Загрузка файла'), ('importing', 'Импорт товаров'), ('done', 'Завершен'), ('failed', 'Ошибка')], default='queued', max_length=15, verbose_name='Этап')),
+                ('processed', models.PositiveIntegerField(default=0, verbose_name='Обработано товаров')),
+                ('stats', models.JSONField(blank=True, default=dict, verbose_name='Результат')),
+                ('errors', models.TextField(blank=True, verbose_name='Ошибки')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('shop', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='import_jobs', to='backend.shop', verbose_name='Магазин')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Задача импорта',
+                'verbose_name_plural': 'Задачи импорта',
+                'ordering': ('-created_at',),
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.2 on 2026-10-18 03:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0010_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='content_digest',
+            field=models.CharField(blank=True, max_length=64, verbose_name='SHA-256 прайс-листа'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='etag',
+            field=models.CharField(blank=True, max_length=255, verbose_name='ETag прайс-листа'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='last_modified',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Last-Modified прайс-листа'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.2 on 2026-10-18 03:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0012_importjob_dry_run'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='productinfo',
+            name='unique_product_info',
+        ),
+        migrations.AddField(
+            model_name='productinfo',
+            name='retired_version',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Снято в версии'),
+        ),
+        migrations.AddField(
+            model_name='productinfo',
+            name='version',
+            field=models.PositiveIntegerField(default=0, verbose_name='Версия каталога'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='catalog_version',
+            field=models.PositiveIntegerField(default=0, verbose_name='Версия каталога'),
+        ),
+        migrations.AddConstraint(
+            model_name='productinfo',
+            constraint=models.UniqueConstraint(condition=models.Q(('retired_version', None)), fields=('product', 'shop', 'ext_id'), name='unique_product_info'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.2 on 2026-10-18 03:47
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Копия запроса из backend.search на момент миграции: последующие изменения запроса ее не затрагивают
+UPDATE_SEARCH_VECTORS_SQL = """
+    UPDATE backend_productinfo AS product_info SET search_vector =
+        setweight(to_tsvector('russian', product.name), 'A')
+        || setweight(to_tsvector('russian', product_info.model), 'B')
+        || setweight(to_tsvector('russian', coalesce((
+            SELECT string_agg(parameter.value, ' ') FROM backend_productparameter AS parameter
+            WHERE parameter.product_info_id = product_info.id
+        ), '')), 'C')
+    FROM backend_product AS product
+    WHERE product.id = product_info.product_id
+"""
+
+
+def create_trigram_index(apps, schema_editor):
+    """
+    Устанавливает pg_trgm и создает триграммный индекс по названию продукта для нечеткого поиска.
+    Если расширение недоступно на сервере, поиск работает только по полнотекстовому индексу.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm')")
+        if not cursor.fetchone()[0]:
+            return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute('CREATE INDEX IF NOT EXISTS product_name_trgm ON backend_product '
+                          'USING gin (name gin_trgm_ops)')
+
+
+def drop_trigram_index(apps, schema_editor):
+    schema_editor.execute('DROP INDEX IF EXISTS product_name_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0015_parameter_facets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productinfo',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='product_info_search'),
+        ),
+        migrations.RunSQL(UPDATE_SEARCH_VECTORS_SQL, migrations.RunSQL.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.2 on 2026-10-18 03:50
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Копия запроса из backend.catalog на момент миграции: последующие изменения запроса ее не затрагивают
+INSERT_CATALOG_ITEMS_SQL = """
+    INSERT INTO backend_catalogitem (id, shop_id, shop_name, shop_state, product_id, product_name, category_id,
+                                     category_name, model, ext_id, quantity, price, price_rrc, parameters,
+                                     search_vector)
+    SELECT product_info.id, shop.id, shop.name, shop.state, product.id, product.name, category.id, category.name,
+           product_info.model, product_info.ext_id, product_info.quantity, product_info.price, product_info.price_rrc,
+           coalesce((
+               SELECT jsonb_object_agg(parameter.name, product_parameter.value)
+               FROM backend_productparameter AS product_parameter
+               JOIN backend_parameter AS parameter ON parameter.id = product_parameter.parameter_id
+               WHERE product_parameter.product_info_id = product_info.id
+           ), '{}'::jsonb),
+           product_info.search_vector
+    FROM backend_productinfo AS product_info
+    JOIN backend_shop AS shop ON shop.id = product_info.shop_id
+    JOIN backend_product AS product ON product.id = product_info.product_id
+    JOIN backend_category AS category ON category.id = product.category_id
+    WHERE product_info.version <= shop.catalog_version
+      AND (product_info.retired_version IS NULL OR product_info.retired_version > shop.catalog_version)
+      AND NOT EXISTS (SELECT 1 FROM backend_catalogitem AS item WHERE item.id = product_info.id)
+"""
+
+
+def create_trigram_index(apps, schema_editor):
+    """Триграммный индекс по названию продукта в каталоге, если установлено расширение pg_trgm."""
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+        if not cursor.fetchone()[0]:
+            return
+    schema_editor.execute('CREATE INDEX IF NOT EXISTS catalog_item_name_trgm ON backend_catalogitem '
+                          'USING gin (product_name gin_trgm_ops)')
+
+
+def drop_trigram_index(apps, schema_editor):
+    schema_editor.execute('DROP INDEX IF EXISTS catalog_item_name_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0016_product_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogItem',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='ID')),
+                ('shop_name', models.CharField(max_length=60, verbose_name='Название магазина')),
+                ('shop_state', models.BooleanField(verbose_name='Магазин активен')),
+                ('product_name', models.CharField(max_length=60, verbose_name='Название продукта')),
+                ('category_name', models.CharField(max_length=60, verbose_name='Название категории')),
+                ('model', models.CharField(blank=True, max_length=80, verbose_name='Модель')),
+                ('ext_id', models.PositiveIntegerField(verbose_name='Артикул')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Количество')),
+                ('price', models.PositiveIntegerField(verbose_name='Цена')),
+                ('price_rrc', models.PositiveIntegerField(verbose_name='Розничная цена')),
+                ('parameters', models.JSONField(default=dict, verbose_name='Параметры')),
+                ('search_vector', django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_items', to='backend.category', verbose_name='Категория')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_items', to='backend.product', verbose_name='Продукт')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_items', to='backend.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Запись каталога',
+                'verbose_name_plural': 'Каталог',
+                'indexes': [models.Index(fields=['price', 'id'], name='catalog_item_price_id'), django.contrib.postgres.indexes.GinIndex(fields=['parameters'], name='catalog_item_parameters', opclasses=['jsonb_path_ops']), django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='catalog_item_search')],
+            },
+        ),
+        migrations.RunSQL(INSERT_CATALOG_ITEMS_SQL, migrations.RunSQL.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
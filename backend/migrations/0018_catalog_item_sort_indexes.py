@@ -0,0 +1,25 @@
+# Generated by Django 5.2.2 on 2026-10-18 03:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0017_catalogitem'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='catalogitem',
+            index=models.Index(fields=['shop', 'price', 'id'], name='catalog_item_shop_price'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogitem',
+            index=models.Index(fields=['category', 'price', 'id'], name='catalog_item_category_price'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogitem',
+            index=models.Index(fields=['product_name', 'id'], name='catalog_item_name_id'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.2 on 2026-10-18 04:14
+
+from django.db import migrations, models
+
+# Цены уже оформленных заказов фиксируются по текущим ценам предложений
+SNAPSHOT_ORDERED_PRICES_SQL = """
+    UPDATE backend_orderitem AS item SET price = product_info.price
+    FROM backend_productinfo AS product_info, backend_order AS orders
+    WHERE product_info.id = item.product_info_id AND orders.id = item.order_id AND orders.state <> 'basket'
+"""
+
+# Копия запроса из backend.basket на момент миграции (для всех заказов): последующие изменения запроса
+# ее не затрагивают
+ORDER_TOTALS_SQL = """
+    UPDATE backend_order AS target SET total_sum = totals.total_sum, item_count = totals.item_count
+    FROM (
+        SELECT orders.id,
+               coalesce(sum(coalesce(item.price, product_info.price) * item.quantity), 0) AS total_sum,
+               count(item.id) AS item_count
+        FROM backend_order AS orders
+        LEFT JOIN backend_orderitem AS item ON item.order_id = orders.id
+        LEFT JOIN backend_productinfo AS product_info ON product_info.id = item.product_info_id
+        GROUP BY orders.id
+    ) AS totals
+    WHERE target.id = totals.id
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0018_catalog_item_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество позиций'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_sum',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='Сумма заказа'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='price',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Цена'),
+        ),
+        migrations.RunSQL(SNAPSHOT_ORDERED_PRICES_SQL, migrations.RunSQL.noop),
+        migrations.RunSQL(ORDER_TOTALS_SQL, migrations.RunSQL.noop),
+    ]
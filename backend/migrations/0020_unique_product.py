@@ -0,0 +1,31 @@
+# Generated by Django 5.2.2 on 2026-10-18 04:27
+
+from django.db import migrations, models
+
+# Дубликаты продуктов (одинаковые категория и название) объединяются в продукт с наименьшим id
+MERGE_DUPLICATE_PRODUCTS_SQL = """
+    CREATE TEMPORARY TABLE product_duplicate ON COMMIT DROP AS
+    SELECT id, keep_id FROM (
+        SELECT id, min(id) OVER (PARTITION BY category_id, name) AS keep_id FROM backend_product
+    ) AS product WHERE id <> keep_id;
+    UPDATE backend_productinfo AS product_info SET product_id = duplicate.keep_id
+    FROM product_duplicate AS duplicate WHERE product_info.product_id = duplicate.id;
+    UPDATE backend_catalogitem AS catalog_item SET product_id = duplicate.keep_id
+    FROM product_duplicate AS duplicate WHERE catalog_item.product_id = duplicate.id;
+    DELETE FROM backend_product AS product USING product_duplicate AS duplicate WHERE product.id = duplicate.id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0019_order_totals'),
+    ]
+
+    operations = [
+        migrations.RunSQL(MERGE_DUPLICATE_PRODUCTS_SQL, migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(fields=('category', 'name'), name='unique_product'),
+        ),
+    ]
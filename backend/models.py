@@ -1,9 +1,12 @@
 from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 import uuid
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
+from django.core.cache import cache
 from django.contrib.auth.validators import UnicodeUsernameValidator
 
 STATE_CHOICES = (
@@ -22,6 +25,14 @@ USER_TYPE_CHOICES = (
 
 )
 
+IMPORT_PHASE_CHOICES = (
+    ('queued', 'В очереди'),
+    ('downloading', 'Загрузка файла'),
+    ('importing', 'Импорт товаров'),
+    ('done', 'Завершен'),
+    ('failed', 'Ошибка'),
+)
+
 # Create your models here.
 
 
@@ -151,6 +162,12 @@ class Shop(models.Model):
     url = models.URLField(null=True, blank=True, unique=True)
     user = models.OneToOneField(User, verbose_name='Продавец', on_delete=models.CASCADE, blank=True, null=True)
     state = models.BooleanField(verbose_name="Активен", default=True)
+    # Валидаторы последней успешной загрузки прайс-листа по ссылке url
+    etag = models.CharField(verbose_name='ETag прайс-листа', max_length=255, blank=True)
+    last_modified = models.CharField(verbose_name='Last-Modified прайс-листа', max_length=64, blank=True)
+    content_digest = models.CharField(verbose_name='SHA-256 прайс-листа', max_length=64, blank=True)
+    # Опубликованная версия каталога: покупателям видны только предложения этой версии
+    catalog_version = models.PositiveIntegerField(verbose_name='Версия каталога', default=0)
 
     class Meta:
         verbose_name = 'Магазин'
@@ -187,13 +204,25 @@ class Product(models.Model):
         verbose_name = 'Продукт'
         verbose_name_plural = 'Продукты'
         ordering = ('-name',)
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'name'], name='unique_product'),
+        ]
 
     def __str__(self):
         return self.name
 
 
+class ProductInfoQuerySet(models.QuerySet):
+
+    def published(self):
+        """Предложения, входящие в опубликованные версии каталогов магазинов."""
+        version = models.F('shop__catalog_version')
+        return self.filter(models.Q(version__lte=version),
+                           models.Q(retired_version__isnull=True) | models.Q(retired_version__gt=version))
+
+
 class ProductInfo(models.Model):
-    objects = models.Manager()
+    objects = ProductInfoQuerySet.as_manager()
     product = models.ForeignKey(Product, verbose_name='Продукт', on_delete=models.CASCADE, related_name='product_info')
     shop = models.ForeignKey(Shop, verbose_name='Магазин', on_delete=models.CASCADE, related_name='product_info')
 
@@ -202,12 +231,22 @@ class ProductInfo(models.Model):
     quantity = models.PositiveIntegerField(verbose_name='Количество')
     price = models.PositiveIntegerField(verbose_name='Цена')
     price_rrc = models.PositiveIntegerField(verbose_name='Розничная цена')
+    # Версия каталога магазина, в которой предложение появилось, и версия, в которой оно заменено или снято
+    version = models.PositiveIntegerField(verbose_name='Версия каталога', default=0)
+    retired_version = models.PositiveIntegerField(verbose_name='Снято в версии', blank=True, null=True)
+    # Название продукта, модель и значения параметров для полнотекстового поиска (см. backend.search)
+    search_vector = SearchVectorField(verbose_name='Поисковый вектор', null=True, editable=False)
 
     class Meta:
         verbose_name = 'Информация о продукте'
         verbose_name_plural = 'Информация о продуктах'
         constraints = [
-            models.UniqueConstraint(fields=['product', 'shop', 'ext_id'], name='unique_product_info'),
+            models.UniqueConstraint(fields=['product', 'shop', 'ext_id'], condition=models.Q(retired_version=None),
+                                    name='unique_product_info'),
+        ]
+        indexes = [
+            models.Index(fields=['price', 'id'], name='product_info_price_id'),
+            GinIndex(fields=['search_vector'], name='product_info_search'),
         ]
 
     def __str__(self):
@@ -244,11 +283,84 @@ class ProductParameter(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['product_info', 'parameter'], name='unique_product_parameter'),
         ]
+        indexes = [
+            # Поиск предложений по значению параметра и подсчет фасетов без обращения к таблице
+            models.Index(fields=['parameter', 'value', 'product_info'], name='product_parameter_value'),
+        ]
 
     def __str__(self):
         return f"{self.parameter.name} {self.value}"
 
 
+class ParameterFacet(models.Model):
+    """
+    Число опубликованных предложений магазина в категории с данным значением параметра.
+    Пересчитывается при публикации каталога магазина и служит для подсчета фасетов без фильтров по параметрам.
+    """
+    objects = models.Manager()
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', on_delete=models.CASCADE, related_name='parameter_facets')
+    category = models.ForeignKey(Category, verbose_name='Категория', on_delete=models.CASCADE,
+                                 related_name='parameter_facets')
+    parameter = models.ForeignKey(Parameter, verbose_name='Параметр', on_delete=models.CASCADE,
+                                  related_name='facets')
+    value = models.CharField(verbose_name='Значение', max_length=60)
+    count = models.PositiveIntegerField(verbose_name='Количество предложений')
+
+    class Meta:
+        verbose_name = 'Фасет параметра'
+        verbose_name_plural = 'Фасеты параметров'
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'category', 'parameter', 'value'], name='unique_parameter_facet'),
+        ]
+
+    def __str__(self):
+        return f"{self.parameter.name} {self.value}: {self.count}"
+
+
+class CatalogItem(models.Model):
+    """
+    Денормализованная запись каталога: опубликованное предложение магазина вместе с данными магазина,
+    продукта, категории и параметрами. Обновляется для магазина после публикации его каталога
+    (см. `backend.catalog`) и служит для вывода списка товаров без соединения таблиц.
+    """
+    objects = models.Manager()
+    # Совпадает с id предложения (ProductInfo)
+    id = models.BigIntegerField(primary_key=True, verbose_name='ID')
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', on_delete=models.CASCADE, related_name='catalog_items')
+    shop_name = models.CharField(max_length=60, verbose_name='Название магазина')
+    shop_state = models.BooleanField(verbose_name='Магазин активен')
+    product = models.ForeignKey(Product, verbose_name='Продукт', on_delete=models.CASCADE,
+                                related_name='catalog_items')
+    product_name = models.CharField(max_length=60, verbose_name='Название продукта')
+    category = models.ForeignKey(Category, verbose_name='Категория', on_delete=models.CASCADE,
+                                 related_name='catalog_items')
+    category_name = models.CharField(max_length=60, verbose_name='Название категории')
+    model = models.CharField(max_length=80, verbose_name='Модель', blank=True)
+    ext_id = models.PositiveIntegerField(verbose_name='Артикул')
+    quantity = models.PositiveIntegerField(verbose_name='Количество')
+    price = models.PositiveIntegerField(verbose_name='Цена')
+    price_rrc = models.PositiveIntegerField(verbose_name='Розничная цена')
+    # Название параметра -> значение
+    parameters = models.JSONField(verbose_name='Параметры', default=dict)
+    search_vector = SearchVectorField(verbose_name='Поисковый вектор', null=True, editable=False)
+
+    class Meta:
+        verbose_name = 'Запись каталога'
+        verbose_name_plural = 'Каталог'
+        indexes = [
+            models.Index(fields=['price', 'id'], name='catalog_item_price_id'),
+            # Сортировка по цене и названию внутри магазина и категории
+            models.Index(fields=['shop', 'price', 'id'], name='catalog_item_shop_price'),
+            models.Index(fields=['category', 'price', 'id'], name='catalog_item_category_price'),
+            models.Index(fields=['product_name', 'id'], name='catalog_item_name_id'),
+            GinIndex(fields=['parameters'], opclasses=['jsonb_path_ops'], name='catalog_item_parameters'),
+            GinIndex(fields=['search_vector'], name='catalog_item_search'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_name} {self.model}'
+
+
 class Order(models.Model):
     objects = models.Manager()
     user = models.ForeignKey(User, verbose_name='Пользователь',
@@ -261,6 +373,10 @@ class Order(models.Model):
                                 on_delete=models.CASCADE,
                                 blank=True,
                                 null=True)
+    # Сумма и число позиций хранятся в заказе и пересчитываются при каждом изменении позиций
+    # (см. `backend.basket.update_order_totals`)
+    total_sum = models.PositiveBigIntegerField(verbose_name='Сумма заказа', default=0)
+    item_count = models.PositiveIntegerField(verbose_name='Количество позиций', default=0)
 
     class Meta:
         verbose_name = 'Заказ'
@@ -285,6 +401,8 @@ class OrderItem(models.Model):
                                      blank=True)
 
     quantity = models.PositiveIntegerField(verbose_name='Количество')
+    # Цена на момент оформления заказа; у позиций корзины не задана, используется текущая цена предложения
+    price = models.PositiveIntegerField(verbose_name='Цена', null=True, blank=True)
 
     class Meta:
         verbose_name = 'Позиция заказа'
@@ -292,3 +410,49 @@ class OrderItem(models.Model):
         constraints = [
                     models.UniqueConstraint(fields=['product_info', 'order_id'], name='unique_product_order'),
                 ]
+
+
+class ImportJob(models.Model):
+    objects = models.Manager()
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, verbose_name='Пользователь',
+                             on_delete=models.CASCADE,
+                             related_name='import_jobs')
+    shop = models.ForeignKey(Shop, verbose_name='Магазин',
+                             on_delete=models.SET_NULL,
+                             related_name='import_jobs',
+                             blank=True,
+                             null=True)
+    url = models.URLField(verbose_name='Ссылка на прайс-лист')
+    dry_run = models.BooleanField(verbose_name='Пробный запуск', default=False)
+    phase = models.CharField(max_length=15, verbose_name='Этап', choices=IMPORT_PHASE_CHOICES, default='queued')
+    processed = models.PositiveIntegerField(verbose_name='Обработано товаров', default=0)
+    stats = models.JSONField(verbose_name='Результат', default=dict, blank=True)
+    errors = models.TextField(verbose_name='Ошибки', blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Задача импорта'
+        verbose_name_plural = 'Задачи импорта'
+        ordering = ('-created_at',)
+
+    def __str__(self):
+        return f'{self.url} {self.phase}'
+
+    @property
+    def progress_key(self):
+        return f'import_job_progress:{self.id}'
+
+    def set_progress(self, processed):
+        """
+        Сохраняет число обработанных товаров в кэш, чтобы не записывать строку задачи после каждого пакета.
+        Пробный запуск идет в одной транзакции, и изменения строки задачи не видны до ее завершения.
+        """
+        cache.set(self.progress_key, processed, timeout=60 * 60 * 24)
+
+    def get_progress(self):
+        if self.phase == 'importing':
+            return cache.get(self.progress_key, self.processed)
+        return self.processed
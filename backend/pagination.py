@@ -0,0 +1,192 @@
+import base64
+import binascii
+import json
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Постраничный вывод по ключу (keyset): страница выбирается условием по значениям упорядочивающих
+    полей последней записи предыдущей страницы, а не смещением OFFSET, поэтому дальние страницы
+    обходятся так же дешево, как первая.
+
+    Порядок задается параметром `ordering` из `orderings`; к каждому порядку добавляется id, чтобы
+    он был строгим. Порядок по умолчанию представление может задать атрибутом `default_ordering`.
+    Поля порядка могут быть аннотациями запроса (например, релевантность поиска `rank`).
+    Курсор - закодированные значения полей граничной записи и направление обхода.
+
+    Если представление задает колонки `values_columns`, страница читается словарями через `values()`
+    (вместе с полями порядка, нужными для курсора).
+    """
+
+    page_size = 50
+    max_page_size = 500
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    # Название порядка -> поля сортировки (последним должен быть уникальный id)
+    orderings = {
+        'id': ('id',),
+        '-id': ('-id',),
+        'price': ('price', 'id'),
+        '-price': ('-price', '-id'),
+        'name': ('product_name', 'id'),
+        '-name': ('-product_name', '-id'),
+        'rank': ('-rank', '-id'),
+    }
+    default_ordering = 'id'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.fields = [field.lstrip('-') for field in self.ordering]
+        cursor = self.decode_cursor(request, queryset)
+        self.reverse = bool(cursor and cursor['reverse'])
+
+        ordering = [self.invert(field) for field in self.ordering] if self.reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if cursor:
+            queryset = queryset.filter(self.after(ordering, cursor['values']))
+        columns = getattr(view, 'values_columns', None)
+        if columns is not None:
+            queryset = queryset.values(*dict.fromkeys([*columns, *self.fields]))
+        # Лишняя запись показывает, есть ли следующая страница в направлении обхода
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+
+        self.results = results
+        self.has_next = has_more if not self.reverse else cursor is not None
+        self.has_previous = cursor is not None if not self.reverse else has_more
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            raise ValidationError({self.page_size_query_param: 'Размер страницы должен быть целым числом'})
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_ordering(self, request, queryset, view=None):
+        default = getattr(view, 'default_ordering', self.default_ordering)
+        ordering = request.query_params.get(self.ordering_query_param, default)
+        available = [name for name, fields in self.orderings.items()
+                     if all(self.has_field(queryset, field.lstrip('-')) for field in fields)]
+        if ordering not in available:
+            raise ValidationError({self.ordering_query_param: f'Допустимые значения: {", ".join(available)}'})
+        return self.orderings[ordering]
+
+    @staticmethod
+    def has_field(queryset, name):
+        if name in queryset.query.annotations:
+            return True
+        try:
+            queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return False
+        return True
+
+    @staticmethod
+    def model_field(queryset, name):
+        """Поле модели или выходное поле аннотации `name`."""
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        return queryset.model._meta.get_field(name)
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def after(ordering, values):
+        """
+        Условие "строго после записи со значениями `values`" для порядка `ordering`.
+        Первое поле дополнительно ограничивается нестрогим неравенством, чтобы по нему работал поиск по индексу.
+        """
+        lookups = [(field.lstrip('-'), 'lt' if field.startswith('-') else 'gt') for field in ordering]
+        condition = Q()
+        for position, (field, lookup) in enumerate(lookups):
+            equal = {name: values[index] for index, (name, _) in enumerate(lookups[:position])}
+            condition |= Q(**equal, **{f'{field}__{lookup}': values[position]})
+        first_field, first_lookup = lookups[0]
+        return Q(**{f'{first_field}__{first_lookup}e': values[0]}) & condition
+
+    def decode_cursor(self, request, queryset):
+        """
+        Курсор из параметра запроса. Значения приводятся к типам полей порядка, поэтому измененный
+        курсор с неподходящими значениями дает 404, а не ошибку при выполнении запроса.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            values, reverse = cursor['v'], cursor['r']
+        except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.fields) or None in values:
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            values = [self.model_field(queryset, field).to_python(value) for field, value in zip(self.fields, values)]
+        except (DjangoValidationError, ValueError, TypeError):
+            raise NotFound(self.invalid_cursor_message)
+        return {'values': values, 'reverse': bool(reverse)}
+
+    def encode_cursor(self, instance, reverse):
+        if isinstance(instance, dict):
+            values = [instance[field] for field in self.fields]
+        else:
+            values = [getattr(instance, field) for field in self.fields]
+        cursor = {'v': values, 'r': reverse}
+        encoded = base64.urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode('ascii')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.results:
+            return None
+        return self.encode_cursor(self.results[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.results:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.results[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {'name': self.cursor_query_param, 'required': False, 'in': 'query',
+             'description': 'Курсор страницы из ссылок next/previous', 'schema': {'type': 'string'}},
+            {'name': self.page_size_query_param, 'required': False, 'in': 'query',
+             'description': f'Количество записей на странице (не более {self.max_page_size})',
+             'schema': {'type': 'integer'}},
+            {'name': self.ordering_query_param, 'required': False, 'in': 'query',
+             'description': f'Порядок: {", ".join(self.orderings)}', 'schema': {'type': 'string'}},
+        ]
@@ -0,0 +1,28 @@
+import ujson
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.utils import json
+from backend.renderers import UJSONRenderer
+
+
+class UJSONParser(JSONParser):
+    """
+    JSON parser на ujson.
+
+    ujson принимает константы NaN, Infinity и -Infinity, поэтому при `STRICT_JSON` тело, в котором они
+    могут встретиться, разбирается стандартным json с теми же проверками, что и в `JSONParser`.
+    """
+
+    renderer_class = UJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            text = stream.read().decode(encoding)
+            if self.strict and ('NaN' in text or 'Infinity' in text):
+                return json.loads(text)
+            return ujson.loads(text)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,285 @@
+import csv
+import gzip
+import hashlib
+import io
+import itertools
+import json
+from http import HTTPStatus
+from pathlib import PurePosixPath
+from tempfile import TemporaryFile
+from urllib.parse import urlparse
+import requests
+import yaml
+
+# Размер блока при скачивании прайс-листа
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class PriceList:
+    """
+    Прайс-лист, уже загруженный в память: словарь с ключами shop, categories и goods.
+
+    Потоковые форматы наследуются от этого класса и заполняют `header` по мере чтения:
+    категории могут пополняться во время обхода `goods()`.
+    """
+
+    def __init__(self, data=None):
+        self.header = data or {}
+
+    @property
+    def shop(self):
+        return self.header.get('shop')
+
+    @property
+    def categories(self):
+        return self.header.get('categories') or []
+
+    def goods(self):
+        return iter(self.header.get('goods') or [])
+
+
+class YamlPriceList(PriceList):
+    """
+    Потоковое чтение прайс-листа в формате YAML.
+
+    Документ разбирается по событиям парсера: заголовок (shop, categories) читается целиком,
+    а товары из раздела goods собираются по одному, поэтому весь документ в памяти не хранится.
+    Если ключ shop следует после раздела goods (например, в файлах с отсортированными ключами),
+    раздел пропускается без построения объектов, а поток перематывается к его началу.
+    """
+
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+        self.loader = yaml.SafeLoader(stream)
+        self.has_goods = False
+        self.read_header()
+        if self.has_goods and 'shop' not in self.header and getattr(stream, 'seekable', lambda: False)():
+            self.skip_node()
+            self.read_mapping_until()
+            stream.seek(0)
+            self.loader.dispose()
+            self.loader = yaml.SafeLoader(stream)
+            self.read_header()
+
+    def read_header(self):
+        """Читает ключи верхнего уровня до раздела goods."""
+        loader = self.loader
+        loader.get_event()  # StreamStartEvent
+        if loader.check_event(yaml.StreamEndEvent):
+            return
+        loader.get_event()  # DocumentStartEvent
+        if not loader.check_event(yaml.MappingStartEvent):
+            raise ValueError('Прайс-лист должен быть словарем с ключами shop, categories и goods')
+        loader.get_event()
+        self.has_goods = self.read_mapping_until('goods')
+
+    def read_mapping_until(self, stop_key=None):
+        """Читает пары ключ-значение текущего словаря, пока не встретится ключ `stop_key`."""
+        loader = self.loader
+        while not loader.check_event(yaml.MappingEndEvent):
+            key = self.read_node()
+            if key == stop_key:
+                return True
+            self.header[key] = self.read_node()
+        return False
+
+    def skip_node(self):
+        """Пропускает очередной узел документа, не создавая объектов Python."""
+        depth = 0
+        while True:
+            event = self.loader.get_event()
+            if isinstance(event, (yaml.SequenceStartEvent, yaml.MappingStartEvent)):
+                depth += 1
+            elif isinstance(event, (yaml.SequenceEndEvent, yaml.MappingEndEvent)):
+                depth -= 1
+            if depth == 0:
+                return
+
+    def read_node(self):
+        """Собирает и преобразует в объект Python очередной узел документа."""
+        return self.loader.construct_document(self.loader.compose_node(None, None))
+
+    def goods(self):
+        """Генератор товаров из раздела goods."""
+        if not self.has_goods:
+            return
+        self.has_goods = False
+        loader = self.loader
+        if not loader.check_event(yaml.SequenceStartEvent):
+            # Пустой раздел goods
+            self.read_node()
+        else:
+            loader.get_event()
+            while not loader.check_event(yaml.SequenceEndEvent):
+                yield self.read_node()
+            loader.get_event()
+        self.read_mapping_until()
+
+    def dispose(self):
+        self.loader.dispose()
+
+
+class JsonLinesPriceList(PriceList):
+    """
+    Потоковое чтение прайс-листа в формате JSON Lines (NDJSON).
+
+    Каждая строка - отдельный JSON-объект. Объекты с ключами shop и/или categories составляют заголовок
+    и должны предшествовать товарам, остальные строки - товары в том же виде, что и в YAML.
+    """
+
+    header_keys = {'shop', 'categories'}
+
+    def __init__(self, stream):
+        super().__init__()
+        self.lines = (line for line in stream if line.strip())
+        self.first_item = None
+        for line in self.lines:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError('Строка прайс-листа должна быть JSON-объектом')
+            if record.keys() <= self.header_keys:
+                self.header.update(record)
+            else:
+                self.first_item = record
+                break
+
+    def goods(self):
+        if self.first_item is not None:
+            yield self.first_item
+            self.first_item = None
+        for line in self.lines:
+            yield json.loads(line)
+
+
+class CsvPriceList(PriceList):
+    """
+    Потоковое чтение прайс-листа в формате CSV.
+
+    Первая строка - заголовок с колонками shop, category, category_name, id, model, name,
+    price, price_rrc, quantity. Параметры товара задаются колонками вида `param:<название>`,
+    пустые значения параметров пропускаются. Магазин берется из первой строки,
+    категории собираются из колонок category и category_name по мере чтения.
+    """
+
+    parameter_prefix = 'param:'
+    integer_fields = ('id', 'category', 'price', 'price_rrc', 'quantity')
+
+    def __init__(self, stream):
+        super().__init__()
+        self.reader = csv.DictReader(stream)
+        self.category_names = {}
+        self.first_row = next(self.reader, None)
+        if self.first_row:
+            self.header['shop'] = self.first_row.get('shop')
+            self.add_category(self.first_row)
+
+    @property
+    def categories(self):
+        return [{'id': category_id, 'name': name} for category_id, name in self.category_names.items()]
+
+    def add_category(self, row):
+        if row.get('category_name'):
+            self.category_names.setdefault(int(row['category']), row['category_name'])
+
+    def goods(self):
+        if self.first_row is None:
+            return
+        rows = itertools.chain([self.first_row], self.reader)
+        self.first_row = None
+        for row in rows:
+            self.add_category(row)
+            item = {'model': row.get('model') or '', 'name': row['name'], 'parameters': {}}
+            for field in self.integer_fields:
+                item[field] = int(row[field])
+            for column, value in row.items():
+                if column and column.startswith(self.parameter_prefix) and value not in (None, ''):
+                    item['parameters'][column[len(self.parameter_prefix):]] = value
+            yield item
+
+
+# Форматы прайс-листов: название -> (класс, нужен ли текстовый поток)
+FORMATS = {
+    'yaml': (YamlPriceList, False),
+    'jsonl': (JsonLinesPriceList, True),
+    'csv': (CsvPriceList, True),
+}
+
+EXTENSIONS = {
+    '.yaml': 'yaml',
+    '.yml': 'yaml',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.csv': 'csv',
+}
+
+CONTENT_TYPES = {
+    'application/yaml': 'yaml',
+    'application/x-yaml': 'yaml',
+    'text/yaml': 'yaml',
+    'text/x-yaml': 'yaml',
+    'application/x-ndjson': 'jsonl',
+    'application/ndjson': 'jsonl',
+    'application/jsonl': 'jsonl',
+    'application/json-lines': 'jsonl',
+    'text/csv': 'csv',
+}
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def detect_format(name='', content_type=''):
+    """Определяет формат прайс-листа по типу содержимого или расширению файла."""
+    content_type = content_type.split(';')[0].strip().lower()
+    if content_type in CONTENT_TYPES:
+        return CONTENT_TYPES[content_type]
+    path = urlparse(name).path if '://' in name else name
+    suffixes = [suffix.lower() for suffix in PurePosixPath(path).suffixes]
+    if suffixes and suffixes[-1] == '.gz':
+        suffixes.pop()
+    return EXTENSIONS.get(suffixes[-1] if suffixes else '', 'yaml')
+
+
+def open_price_list(file, name='', content_type=''):
+    """
+    Открывает прайс-лист из бинарного файла с произвольным доступом для потокового чтения.
+    Сжатие gzip распознается по сигнатуре файла и распаковывается на лету.
+    """
+    magic = file.read(len(GZIP_MAGIC))
+    file.seek(0)
+    if magic == GZIP_MAGIC:
+        file = gzip.GzipFile(fileobj=file)
+    price_list_class, text = FORMATS[detect_format(name, content_type)]
+    if text:
+        file = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    return price_list_class(file)
+
+
+def download(url, etag='', last_modified='', **kwargs):
+    """
+    Скачивает файл по ссылке во временный файл на диске.
+
+    Если переданы валидаторы прошлой загрузки, запрос выполняется условным. Возвращает пару
+    (файл, открытый на чтение, или None при ответе 304 Not Modified; валидаторы и тип содержимого ответа).
+    """
+    headers = kwargs.pop('headers', {})
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    digest = hashlib.sha256()
+    with requests.get(url, stream=True, headers=headers, **kwargs) as response:
+        if response.status_code == HTTPStatus.NOT_MODIFIED:
+            return None, {'etag': etag, 'last_modified': last_modified}
+        response.raise_for_status()
+        file = TemporaryFile()
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            file.write(chunk)
+            digest.update(chunk)
+    file.seek(0)
+    return file, {
+        'etag': response.headers.get('ETag', ''),
+        'last_modified': response.headers.get('Last-Modified', ''),
+        'content_digest': digest.hexdigest(),
+        'content_type': response.headers.get('Content-Type', ''),
+    }
@@ -0,0 +1,22 @@
+import ujson
+from rest_framework.renderers import JSONRenderer
+
+
+class UJSONRenderer(JSONRenderer):
+    """
+    JSON renderer на ujson. Вывод совпадает с `JSONRenderer`: компактный, без экранирования кириллицы и `/`;
+    типы, которых ujson не знает (даты, UUID, ленивые строки), кодируются его же encoder'ом.
+    Форматированный вывод (`indent`) и значения, которые ujson не может закодировать, отдаются `JSONRenderer`.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = ujson.dumps(data, ensure_ascii=self.ensure_ascii, escape_forward_slashes=False,
+                              allow_nan=not self.strict, default=self.encoder_class().default)
+        except (OverflowError, TypeError):
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode()
@@ -0,0 +1,57 @@
+from functools import lru_cache
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connection
+from django.db.models import F, Q, FloatField
+from django.db.models.functions import Cast
+
+# Конфигурация полнотекстового поиска PostgreSQL
+SEARCH_CONFIG = 'russian'
+
+# Поисковый вектор предложения: название продукта (вес A), модель (B) и значения параметров (C)
+UPDATE_SEARCH_VECTORS_SQL = f"""
+    UPDATE backend_productinfo AS product_info SET search_vector =
+        setweight(to_tsvector('{SEARCH_CONFIG}', product.name), 'A')
+        || setweight(to_tsvector('{SEARCH_CONFIG}', product_info.model), 'B')
+        || setweight(to_tsvector('{SEARCH_CONFIG}', coalesce((
+            SELECT string_agg(parameter.value, ' ') FROM backend_productparameter AS parameter
+            WHERE parameter.product_info_id = product_info.id
+        ), '')), 'C')
+    FROM backend_product AS product
+    WHERE product.id = product_info.product_id
+"""
+
+
+def update_search_vectors(product_info_ids):
+    """Пересчитывает поисковые векторы предложений одним запросом."""
+    if not product_info_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(UPDATE_SEARCH_VECTORS_SQL + ' AND product_info.id = ANY(%s)', [list(product_info_ids)])
+
+
+@lru_cache(maxsize=None)
+def trigram_enabled():
+    """Установлено ли в БД расширение pg_trgm для нечеткого поиска."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+        return cursor.fetchone()[0]
+
+
+def search_products(queryset, text, name_field='product__name'):
+    """
+    Отбирает предложения по поисковому запросу и добавляет к ним оценку релевантности `rank`.
+
+    Запрос сопоставляется с поисковым вектором предложения (GIN-индекс по `search_vector`).
+    Если доступно расширение pg_trgm, дополнительно находятся товары, название которых (поле `name_field`)
+    похоже на запрос с учетом опечаток (триграммный GIN-индекс по названию продукта).
+
+    Оценка приводится к double precision: значение real не совпадает с прочитанным из курсора
+    постраничного вывода числом, и записи с равной оценкой на границе страниц повторялись бы или пропускались.
+    """
+    query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+    condition = Q(search_vector=query)
+    rank = SearchRank(F('search_vector'), query)
+    if trigram_enabled():
+        condition |= Q(**{f'{name_field}__trigram_word_similar': text})
+        rank = rank + TrigramWordSimilarity(text, name_field)
+    return queryset.filter(condition).annotate(rank=Cast(rank, FloatField()))
@@ -1,6 +1,16 @@
+from operator import attrgetter, itemgetter
 from rest_framework import serializers
 from django.contrib.auth import authenticate
-from backend.models import User, Contact, Shop, Category, ProductInfo, Product, ProductParameter, Order, OrderItem
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.utils import timezone
+from backend.models import User, Contact, Shop, Category, ProductInfo, Product, ProductParameter, Order, OrderItem, \
+    ImportJob, CatalogItem
+from backend.catalog import ParameterList
+
+# Наибольшие количество товара в позиции (integer в БД) и ID записи (bigint)
+MAX_QUANTITY = 2147483647
+MAX_ID = 9223372036854775807
 
 
 class ContactSerializer(serializers.ModelSerializer):
@@ -81,32 +91,249 @@ class CategorySerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class FastListSerializer(serializers.ListSerializer):
+    """
+    Быстрый вывод списка: представление каждого объекта строится функцией, подготовленной дочерним
+    serializer'ом один раз для всего списка (см. `FastRepresentationMixin`).
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        return list(map(self.child.fast_representation(), iterable))
+
+
+class FastRepresentationMixin:
+    """
+    Быстрый путь вывода списков (`many=True`) с тем же видом ответа, что и у обычного.
+
+    По выводимым полям один раз строятся функции чтения значений из объекта: простые поля читаются
+    атрибутом, связи - идентификатором, вложенные serializer'ы с этим же классом - своими функциями.
+    Поля, которым нужно преобразование (даты, десятичные числа, строковое представление), выводятся
+    через `to_representation` поля DRF. В подклассах нужно указать `Meta.list_serializer_class = FastListSerializer`.
+
+    Для плоских моделей вывод можно строить из строк `values()`, не создавая объекты моделей
+    (см. `values_representation`).
+    """
+
+    # Вычисляемое поле -> (колонки, функция построения значения из строки values())
+    values_fields = {}
+    # Колонки, вычисляемые в запросе: название аннотации -> выражение
+    values_expressions = {}
+
+    def fast_representation(self):
+        """Функция, возвращающая представление объекта в виде словаря."""
+        getters = [(field.field_name, self.fast_getter(field)) for field in self._readable_fields]
+
+        def represent(obj):
+            data = {}
+            for name, get in getters:
+                data[name] = get(obj)
+            return data
+        return represent
+
+    def fast_getter(self, field):
+        """Функция, возвращающая значение поля `field` для объекта."""
+        if isinstance(field, serializers.SerializerMethodField):
+            return getattr(field.parent, field.method_name)
+        if field.source == '*':
+            return field.to_representation
+        get = attrgetter(field.source)
+        if isinstance(field, serializers.ListSerializer) and isinstance(field.child, FastRepresentationMixin):
+            represent = field.child.fast_representation()
+            return lambda obj: list(map(represent, get(obj).all()))
+        if isinstance(field, serializers.PrimaryKeyRelatedField):
+            return attrgetter(field.source + '_id')
+        if isinstance(field, (serializers.IntegerField, serializers.CharField, serializers.BooleanField)):
+            return get
+        if isinstance(field, FastRepresentationMixin):
+            represent = field.fast_representation()
+        elif isinstance(field, serializers.StringRelatedField):
+            represent = str
+        else:
+            represent = field.to_representation
+
+        if not self.nullable(field):
+            return lambda obj: represent(get(obj))
+        return self.nullable_getter(get, represent)
+
+    def values_representation(self):
+        """
+        Колонки, которые нужно прочитать через `values()`, и функция, строящая представление по такой строке.
+        Простые поля читаются из колонки модели, вычисляемые - функциями из `values_fields`.
+        Колонки из `values_expressions` нужно добавить в запрос аннотациями (см. `annotate_values`).
+        """
+        columns, getters = [], []
+        for field in self._readable_fields:
+            if isinstance(field, serializers.SerializerMethodField):
+                field_columns, get = self.values_fields[field.field_name]
+            else:
+                column = self.Meta.model._meta.get_field(field.source).attname
+                field_columns, get = (column,), itemgetter(column)
+                if not isinstance(field, (serializers.IntegerField, serializers.CharField,
+                                          serializers.BooleanField, serializers.PrimaryKeyRelatedField)):
+                    get = self.nullable_getter(get, field.to_representation)
+            columns.extend(field_columns)
+            getters.append((field.field_name, get))
+
+        def represent(row):
+            data = {}
+            for name, get in getters:
+                data[name] = get(row)
+            return data
+        return list(dict.fromkeys(columns)), represent
+
+    @classmethod
+    def annotate_values(cls, queryset, columns):
+        """Добавляет в запрос вычисляемые колонки из `columns`."""
+        return queryset.annotate(**{name: expression() for name, expression in cls.values_expressions.items()
+                                    if name in columns})
+
+    @staticmethod
+    def nullable_getter(get, represent):
+        def getter(obj):
+            value = get(obj)
+            return None if value is None else represent(value)
+        return getter
+
+    @staticmethod
+    def nullable(field):
+        """Может ли значение поля быть пустым (для аннотаций и вычисляемых атрибутов - может)."""
+        try:
+            return field.parent.Meta.model._meta.get_field(field.source).null
+        except FieldDoesNotExist:
+            return True
+
+
+class ProductSerializer(FastRepresentationMixin, serializers.ModelSerializer):
     category = serializers.StringRelatedField()
 
     class Meta:
         model = Product
+        list_serializer_class = FastListSerializer
         fields = ('id', 'name', 'category')
         read_only_fields = ('id',)
 
 
-class ProductParameterSerializer(serializers.ModelSerializer):
+class ProductParameterSerializer(FastRepresentationMixin, serializers.ModelSerializer):
     parameter = serializers.StringRelatedField()
 
     class Meta:
         model = ProductParameter
+        list_serializer_class = FastListSerializer
         fields = ('parameter', 'value')
 
 
-class ProductInfoSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """
+    Выборочный вывод полей по спискам `fields` и `expand` из контекста (см. `sparse_context`):
+    `fields` - выводимые поля, `expand` - раскрываемые вложенные объекты из `expandable_fields`.
+    Если `expand` задан, нераскрытое вложенное поле заменяется простым полем или не выводится.
+    """
+
+    # Вложенное поле -> фабрика поля для вывода без раскрытия (None - не выводить)
+    expandable_fields = {}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested, expand = self.context.get('fields'), self.context.get('expand')
+        if expand is not None:
+            for name, plain_field in self.expandable_fields.items():
+                if name not in expand:
+                    if plain_field:
+                        fields[name] = plain_field()
+                    else:
+                        fields.pop(name)
+        if requested is not None:
+            fields = {name: field for name, field in fields.items() if name in requested}
+        return fields
+
+    @classmethod
+    def sparse_context(cls, query_params):
+        """Читает списки полей `fields` и `expand` из параметров запроса."""
+        context = {}
+        for param, allowed in (('fields', cls.Meta.fields), ('expand', cls.expandable_fields)):
+            if param not in query_params:
+                continue
+            names = {name.strip() for name in query_params[param].split(',') if name.strip()}
+            unknown = names - set(allowed)
+            if unknown:
+                raise serializers.ValidationError({param: f'Неизвестные поля: {", ".join(sorted(unknown))}. '
+                                                          f'Допустимые значения: {", ".join(allowed)}'})
+            context[param] = names
+        return context
+
+
+class ProductInfoSerializer(FastRepresentationMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    """Serializer для предложения магазина с выборочным выводом полей (см. `SparseFieldsMixin`)."""
     product = ProductSerializer(read_only=True)
     product_parameter = ProductParameterSerializer(read_only=True, many=True)
 
+    expandable_fields = {
+        'product': lambda: serializers.PrimaryKeyRelatedField(read_only=True),
+        'product_parameter': None,
+    }
+    # Вложенное поле -> (связи, которые нужно загрузить для его вывода; связь "ко многим")
+    related_lookups = {
+        'product': ('product__category', False),
+        'product_parameter': ('product_parameter__parameter', True),
+    }
+
     class Meta:
         model = ProductInfo
+        list_serializer_class = FastListSerializer
         fields = ('id', 'product', 'model', 'shop', 'quantity', 'price', 'price_rrc', 'product_parameter')
         read_only_fields = ('id',)
 
+    @classmethod
+    def load_related(cls, queryset, context, prefix=''):
+        """
+        Добавляет в запрос загрузку только тех связей, которые нужны для вывода запрошенных полей.
+        `prefix` - путь к предложениям, вложенным в объекты запроса; их связи загружаются через prefetch_related.
+        """
+        requested, expand = context.get('fields'), context.get('expand')
+        for name, (lookup, many) in cls.related_lookups.items():
+            if (requested is None or name in requested) and (expand is None or name in expand):
+                if many or prefix:
+                    queryset = queryset.prefetch_related(prefix + lookup)
+                else:
+                    queryset = queryset.select_related(lookup)
+        return queryset
+
+
+class CatalogItemSerializer(FastRepresentationMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Serializer для записи каталога (`CatalogItem`).
+    Выводит товар в том же виде, что и `ProductInfoSerializer`, но без обращения к связанным таблицам.
+    """
+    product = serializers.SerializerMethodField()
+    shop = serializers.IntegerField(source='shop_id', read_only=True)
+    product_parameter = serializers.SerializerMethodField()
+
+    expandable_fields = {
+        'product': lambda: serializers.IntegerField(source='product_id', read_only=True),
+        'product_parameter': None,
+    }
+    values_fields = {
+        'product': (('product_id', 'product_name', 'category_name'), lambda row: {
+            'id': row['product_id'], 'name': row['product_name'], 'category': row['category_name']}),
+        'product_parameter': (('parameter_list',), itemgetter('parameter_list')),
+    }
+    values_expressions = {
+        'parameter_list': lambda: ParameterList('parameters'),
+    }
+
+    class Meta:
+        model = CatalogItem
+        list_serializer_class = FastListSerializer
+        fields = ('id', 'product', 'model', 'shop', 'quantity', 'price', 'price_rrc', 'product_parameter')
+        read_only_fields = fields
+
+    def get_product(self, obj):
+        return {'id': obj.product_id, 'name': obj.product_name, 'category': obj.category_name}
+
+    def get_product_parameter(self, obj):
+        return [{'parameter': name, 'value': value} for name, value in obj.parameters.items()]
+
 
 class OrderedItemsSerializer(serializers.ModelSerializer):
 
@@ -121,21 +348,60 @@ class OrderedItemsSerializer(serializers.ModelSerializer):
         return value
 
     def validate_product_info(self, value):
-        if not ProductInfo.objects.filter(id=value.id).exists():
+        if not ProductInfo.objects.published().filter(id=value.id).exists():
             raise serializers.ValidationError("Продукт с таким ID не существует")
         return value
 
 
-class OrderedItemsFullSerializer(OrderedItemsSerializer):
+class BasketItemSerializer(serializers.Serializer):
+    """
+    Serializer для позиции, добавляемой в корзину. Проверяет только формат позиции:
+    существование товаров проверяется одним запросом для всех позиций (см. `BasketView.post`).
+    """
+    product_info = serializers.IntegerField(min_value=1, max_value=MAX_ID)
+    quantity = serializers.IntegerField(min_value=1, max_value=MAX_QUANTITY, error_messages={
+        'min_value': 'Количество должно быть не менее 1',
+        'max_value': f'Количество должно быть не более {MAX_QUANTITY}'})
+
+
+class OrderedItemsFullSerializer(FastRepresentationMixin, OrderedItemsSerializer):
     product_info = ProductInfoSerializer()
 
+    class Meta(OrderedItemsSerializer.Meta):
+        list_serializer_class = FastListSerializer
+        fields = ('id', 'product_info', 'quantity', 'price', 'order')
+        read_only_fields = ('id', 'price')
 
-class OrderSerializer(serializers.ModelSerializer):
+
+class OrderSerializer(FastRepresentationMixin, serializers.ModelSerializer):
     order_items = OrderedItemsFullSerializer(many=True)
-    total_sum = serializers.DecimalField(max_digits=10, decimal_places=2)
+    # Сумма хранится как bigint (см. `Order.total_sum`): 19 цифр целой части и 2 после запятой
+    total_sum = serializers.DecimalField(max_digits=21, decimal_places=2, read_only=True)
 
     class Meta:
         model = Order
-        fields = ('id', 'order_items', 'total_sum', 'created_at', 'state', 'contact', )
-        read_only_fields = ('id',)
+        list_serializer_class = FastListSerializer
+        fields = ('id', 'order_items', 'total_sum', 'item_count', 'created_at', 'state', 'contact', )
+        read_only_fields = ('id', 'total_sum', 'item_count')
 
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    processed = serializers.SerializerMethodField()
+    throughput = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImportJob
+        fields = ('id', 'url', 'dry_run', 'shop', 'phase', 'processed', 'throughput', 'stats', 'errors',
+                  'created_at', 'started_at', 'finished_at')
+        read_only_fields = fields
+
+    def get_processed(self, obj):
+        return obj.get_progress()
+
+    def get_throughput(self, obj):
+        """Скорость импорта, товаров в секунду."""
+        if not obj.started_at:
+            return None
+        elapsed = ((obj.finished_at or timezone.now()) - obj.started_at).total_seconds()
+        return round(obj.get_progress() / elapsed, 1) if elapsed > 0 else None
@@ -1,6 +1,13 @@
 from django.core.mail import send_mail
 from django.conf import settings
+from contextlib import nullcontext
+from django.db import transaction
+from django.utils import timezone
 from celery import shared_task
+from backend.models import ImportJob, Shop
+from backend.importer import import_price_list, ImportProfiler
+from backend.price_list import open_price_list, download
+from backend.basket import get_basket_store
 
 
 @shared_task()
@@ -13,3 +20,68 @@ def send_mail_task(subject: str, message: str, recipient_list: list):
         recipient_list=recipient_list,
         fail_silently=False,
     )
+
+
+@shared_task()
+def flush_basket_task(user_id: int):
+    """Задача записи корзины пользователя из кэша в БД."""
+    get_basket_store().flush([user_id])
+
+
+@shared_task()
+def import_price_list_task(job_id: str):
+    """
+    Задача загрузки прайс-листа продавца по ссылке.
+    Неизменившийся с прошлой загрузки файл не скачивается повторно и не импортируется.
+    Пробный запуск выполняет загрузку полностью, откатывает изменения и сохраняет статистику по этапам.
+    """
+    job = ImportJob.objects.get(id=job_id)
+    job.phase = 'downloading'
+    job.started_at = timezone.now()
+    job.save(update_fields=['phase', 'started_at'])
+
+    def progress(stats):
+        job.set_progress(stats['inserted'] + stats['updated'] + stats['unchanged'])
+
+    shop = Shop.objects.filter(user_id=job.user_id, url=job.url).first()
+    profiler = ImportProfiler() if job.dry_run else None
+    try:
+        if shop and not job.dry_run:
+            file, response = download(job.url, etag=shop.etag, last_modified=shop.last_modified)
+        else:
+            file, response = download(job.url)
+        if file is None or (shop and not job.dry_run and response['content_digest'] == shop.content_digest):
+            if file:
+                file.close()
+            job.shop = shop
+            job.stats = {'not_modified': True}
+        else:
+            with file:
+                price_list = open_price_list(file, name=job.url, content_type=response['content_type'])
+                if not price_list.shop:
+                    raise ValueError('В прайс-листе не указан магазин')
+                job.phase = 'importing'
+                job.save(update_fields=['phase'])
+                with transaction.atomic() if job.dry_run else nullcontext(), \
+                        profiler.profile() if profiler else nullcontext():
+                    job.shop, created = Shop.objects.get_or_create(name=price_list.shop, user_id=job.user_id)
+                    job.stats = import_price_list(job.shop, price_list, progress=progress, profiler=profiler)
+                    if job.dry_run:
+                        transaction.set_rollback(True)
+                    else:
+                        Shop.objects.filter(id=job.shop.id).update(url=job.url,
+                                                                   etag=response['etag'],
+                                                                   last_modified=response['last_modified'],
+                                                                   content_digest=response['content_digest'])
+            if profiler:
+                job.stats['profile'] = profiler.report()
+            if job.dry_run and created:
+                job.shop = None
+    except Exception as e:
+        job.phase = 'failed'
+        job.errors = str(e)
+    else:
+        job.phase = 'done'
+        job.processed = job.stats.get('inserted', 0) + job.stats.get('updated', 0) + job.stats.get('unchanged', 0)
+    job.finished_at = timezone.now()
+    job.save()
@@ -1,8 +1,8 @@
 from django.contrib import admin
 from django.urls import path, include
 from backend.views import (UserRegisterView, UserLoginView, VerifyEmailView, UserDetailView, ResetPasswordRequestView,
-                           ContactView, ShopsView, CategoriesView, ProductInfoView, GithubLoginView,
-                           PartnerState, PartnerOrders, PartnerUpdate,
+                           ContactView, ShopsView, CategoriesView, ProductInfoView, ProductExportView, GithubLoginView,
+                           PartnerState, PartnerOrders, PartnerUpdate, PartnerUpdateStatus,
                            BasketView, OrderView,
                            SentryDebug)
 from django_rest_passwordreset.views import ResetPasswordConfirm
@@ -21,10 +21,12 @@ urlpatterns = [
     path('user/contact', ContactView.as_view(), name='contacts_list'),
     path('partner/state', PartnerState.as_view(), name='partner_state'),
     path('partner/update', PartnerUpdate.as_view(), name='partner_products_update'),
+    path('partner/update/<uuid:job_id>', PartnerUpdateStatus.as_view(), name='partner_products_update_status'),
     path('partner/orders', PartnerOrders.as_view(), name='partner_orders'),
     path('categories', CategoriesView.as_view(), name='categories_list'),
     path('shops', ShopsView.as_view(), name='shops_list'),
     path('products', ProductInfoView.as_view(), name='products_list'),
+    path('products/export', ProductExportView.as_view(), name='products_export'),
     path('basket', BasketView.as_view(), name='basket'),
     path('order', OrderView.as_view(), name='order_list'),
     # drf-spectacular urls
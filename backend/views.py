@@ -2,25 +2,33 @@ from rest_framework.views import APIView
 from rest_framework.generics import ListAPIView
 from django.contrib.auth.password_validation import validate_password
 from rest_framework.response import Response
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from rest_framework.authtoken.models import Token
 from backend.serializers import UserSerializer, LoginSerializer, ContactSerializer, ShopSerializer, \
-    CategorySerializer, ProductInfoSerializer, OrderSerializer, OrderedItemsSerializer
+    CategorySerializer, ProductInfoSerializer, OrderSerializer, ImportJobSerializer, \
+    CatalogItemSerializer, BasketItemSerializer, MAX_QUANTITY, MAX_ID
 from rest_framework import status
-from .models import EmailVerificationToken, Contact, Shop, Product, Category, ProductInfo, Parameter, \
-    ProductParameter, User, Order, OrderItem
+from .models import EmailVerificationToken, Contact, Shop, Category, ProductInfo, User, Order, ImportJob, \
+    ProductParameter, ParameterFacet, CatalogItem
 from rest_framework.permissions import IsAuthenticated
 from distutils.util import strtobool
-from django.db.models import Q, Sum, F
+from django.db.models import Q, Sum, Count, F, BigIntegerField
+from django.db.models.functions import Cast, Coalesce
 from django.core.validators import URLValidator
 from django.core.exceptions import ValidationError
-from requests import get
-import yaml
 from .permissions import IsVendor
+from .pagination import KeysetPagination
+from .search import search_products
+from .cache import CatalogCacheMixin, SHOP_CATALOG_VERSION_KEY, bump_catalog_version
+from .export import chunk_rows, ndjson_rows, csv_rows, gzip_stream
+from .basket import get_basket_store, checkout_order, InsufficientStock
+import re
 from django.db import IntegrityError
 from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.cache import patch_vary_headers
 from datetime import timedelta
-from backend.tasks import send_mail_task
+from backend.tasks import send_mail_task, import_price_list_task
 from django_rest_passwordreset.serializers import EmailSerializer
 from django_rest_passwordreset.models import ResetPasswordToken, clear_expired, get_password_reset_token_expiry_time
 from drf_spectacular.utils import extend_schema, OpenApiParameter
@@ -566,10 +574,11 @@ class ContactView(APIView):
 @extend_schema(
     summary="Получить список всех категорий",
     description="Возвращает список всех доступных категорий товаров.",
-    responses={200: CategorySerializer(many=True)},
+    responses={200: CategorySerializer(many=True),
+               304: {'description': 'Ответ не изменился с версии, указанной в If-None-Match'}},
     tags=["Категории"]
 )
-class CategoriesView(ListAPIView):
+class CategoriesView(CatalogCacheMixin, ListAPIView):
     """
     Класс для просмотра списка категорий
     """
@@ -581,10 +590,11 @@ class CategoriesView(ListAPIView):
 @extend_schema(
     summary="Получить список активных магазинов",
     description="Возвращает список всех магазинов, у которых состояние (state) установлено как 'активен'.",
-    responses={200: ShopSerializer(many=True)},
+    responses={200: ShopSerializer(many=True),
+               304: {'description': 'Ответ не изменился с версии, указанной в If-None-Match'}},
     tags=["Магазины"]
 )
-class ShopsView(ListAPIView):
+class ShopsView(CatalogCacheMixin, ListAPIView):
     """
     Класс для просмотра списка магазинов
     """
@@ -593,36 +603,227 @@ class ShopsView(ListAPIView):
     serializer_class = ShopSerializer
 
 
-class ProductInfoView(APIView):
+@extend_schema(
+    summary="Получить информацию о товарах",
+    description="Возвращает страницу списка товаров с фильтрацией по магазину, категории и параметрам товара. "
+                "Можно указать параметры запроса `shop_id` и/или `category_id`, а также фильтры по параметрам "
+                "вида `param[Цвет]=золотистый`: разные параметры объединяются по И, несколько значений одного "
+                "параметра - по ИЛИ. Диапазон цен задается параметрами `price_min` и `price_max`, "
+                "сортировка - параметром `ordering` (`price`, `-price`, `name`, `-name`). "
+                "Следующая и предыдущая страницы запрашиваются по ссылкам `next` и `previous`.",
+    parameters=[
+        OpenApiParameter(name='shop_id', type=int, location='query',
+                         description='Фильтр по ID магазина'),
+        OpenApiParameter(name='category_id', type=int, location='query',
+                         description='Фильтр по ID категории товара'),
+        OpenApiParameter(name='search', type=str, location='query',
+                         description='Поиск по названию, модели и параметрам товара с учетом опечаток; '
+                                     'результаты по умолчанию упорядочены по релевантности (`ordering=rank`)'),
+        OpenApiParameter(name='price_min', type=int, location='query',
+                         description='Минимальная цена'),
+        OpenApiParameter(name='price_max', type=int, location='query',
+                         description='Максимальная цена'),
+        OpenApiParameter(name='in_stock', type=bool, location='query',
+                         description='Только товары в наличии'),
+        OpenApiParameter(name='param[Цвет]', type=str, location='query',
+                         description='Фильтр по значению параметра товара (название параметра - в скобках)'),
+        OpenApiParameter(name='facets', type=bool, location='query',
+                         description='Добавить в ответ `facets`: число подходящих товаров '
+                                     'по каждому значению каждого параметра'),
+        OpenApiParameter(name='fields', type=str, location='query',
+                         description='Поля товара через запятую, например `id,price,product`'),
+        OpenApiParameter(name='expand', type=str, location='query',
+                         description='Вложенные объекты товара через запятую: `product`, `product_parameter`. '
+                                     'По умолчанию раскрываются все'),
+    ],
+    responses={200: ProductInfoSerializer(many=True),
+               304: {'description': 'Ответ не изменился с версии, указанной в If-None-Match'}},
+    tags=["Информация о товарах"]
+)
+class ProductInfoView(CatalogCacheMixin, ListAPIView):
     """
     Класс для просмотра товаров
+
+    Товары читаются из денормализованного каталога (`CatalogItem`), который обновляется при публикации
+    прайс-листов, поэтому список строится по одной таблице без соединений. Страница читается словарями
+    через `values()` и выводится без создания объектов моделей (см. `FastRepresentationMixin.values_representation`).
+    Ответы кэшируются до изменения каталога (см. `CatalogCacheMixin`).
     """
 
+    serializer_class = CatalogItemSerializer
+    pagination_class = KeysetPagination
+    parameter_filter = re.compile(r'^param\[(.+)\]$')
+
+    def list(self, request, *args, **kwargs):
+        try:
+            facets = bool(strtobool(request.query_params.get('facets', 'False')))
+            self.range_filters
+        except ValueError as e:
+            return Response({'Status': False, 'Errors': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        columns, represent = self.values_representation
+        queryset = CatalogItemSerializer.annotate_values(self.filter_queryset(self.get_queryset()), columns)
+        page = self.paginate_queryset(queryset)
+        response = self.get_paginated_response(list(map(represent, page)))
+        if facets:
+            response.data['facets'] = self.get_facets()
+        return response
+
+    def get_queryset(self):
+        return self.filter_products().defer('search_vector')
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context.update(CatalogItemSerializer.sparse_context(self.request.query_params))
+        return context
+
+    @cached_property
+    def values_representation(self):
+        """Колонки каталога для `values()` и функция вывода записи по ним."""
+        return self.get_serializer().values_representation()
+
+    @property
+    def values_columns(self):
+        return self.values_representation[0]
+
+    def get_catalog_version_key(self, request):
+        """Список товаров одного магазина сбрасывается только при изменении его каталога."""
+        shop_id = request.query_params.get('shop_id', '')
+        if shop_id.isdigit():
+            return SHOP_CATALOG_VERSION_KEY.format(int(shop_id))
+        return super().get_catalog_version_key(request)
+
+    @property
+    def default_ordering(self):
+        """Порядок страниц по умолчанию: при поиске - по релевантности."""
+        return 'rank' if self.request.query_params.get('search') else 'id'
+
+    def filter_products(self):
+        """Записи каталога, отобранные по параметрам запроса."""
+        queryset = CatalogItem.objects.filter(self.get_filters())
+        for name, values in self.parameter_filters.items():
+            # Поиск по вхождению в JSONB использует GIN-индекс по параметрам
+            query = Q()
+            for value in values:
+                query = query | Q(parameters__contains={name: value})
+            queryset = queryset.filter(query)
+        if self.request.query_params.get('search'):
+            queryset = search_products(queryset, self.request.query_params['search'], name_field='product_name')
+        return queryset
+
+    def get_filters(self):
+        """Условие отбора по магазину и категории."""
+        query = Q(shop_state=True)
+        shop_id = self.request.query_params.get('shop_id')
+        category_id = self.request.query_params.get('category_id')
+        if shop_id:
+            query = query & Q(shop_id=shop_id)
+        if category_id:
+            query = query & Q(category_id=category_id)
+        return query & self.range_filters
+
+    @cached_property
+    def range_filters(self):
+        """Условие отбора по диапазону цен и наличию."""
+        query = Q()
+        for name, lookup in (('price_min', 'price__gte'), ('price_max', 'price__lte')):
+            value = self.request.query_params.get(name)
+            if value:
+                if not value.isdigit():
+                    raise ValueError(f'Параметр {name} должен быть неотрицательным целым числом')
+                query = query & Q(**{lookup: int(value)})
+        if strtobool(self.request.query_params.get('in_stock', 'False')):
+            query = query & Q(quantity__gt=0)
+        return query
+
+    @cached_property
+    def parameter_filters(self):
+        """Фильтры вида param[название]=значение в виде название -> список значений."""
+        filters = {}
+        for key in self.request.query_params:
+            match = self.parameter_filter.match(key)
+            if match:
+                filters[match.group(1)] = self.request.query_params.getlist(key)
+        return filters
+
+    def get_facets(self):
+        """
+        Число подходящих предложений по каждому значению каждого параметра.
+        Без фильтров по параметрам, цене и наличию и без поиска используются фасеты, рассчитанные при публикации каталогов,
+        иначе значения подсчитываются одним запросом с группировкой по индексу (parameter, value, product_info).
+        """
+        if self.parameter_filters or self.range_filters or self.request.query_params.get('search'):
+            counts = ProductParameter.objects.filter(product_info_id__in=self.filter_products().values('id'))
+            counts = counts.values_list('parameter__name', 'value').annotate(count=Count('id'))
+        else:
+            counts = ParameterFacet.objects.filter(shop__state=True)
+            shop_id = self.request.query_params.get('shop_id')
+            category_id = self.request.query_params.get('category_id')
+            if shop_id:
+                counts = counts.filter(shop_id=shop_id)
+            if category_id:
+                counts = counts.filter(category_id=category_id)
+            counts = counts.values_list('parameter__name', 'value').annotate(count=Sum('count'))
+        facets = {}
+        for name, value, count in counts.order_by('parameter__name', '-count', 'value'):
+            facets.setdefault(name, {})[value] = count
+        return facets
+
+
+class ProductExportView(ProductInfoView):
+    """
+    Класс для выгрузки каталога товаров
+
+    Записи читаются серверным курсором блоками и сразу отдаются клиенту, поэтому время до первого байта
+    и расход памяти не зависят от размера каталога.
+    """
+
+    export_types = {
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv',
+    }
+
     @extend_schema(
-        summary="Получить информацию о товарах",
-        description="Возвращает список товаров с фильтрацией по магазину и категории. "
-                    "Можно указать параметры запроса `shop_id` и/или `category_id`.",
+        summary="Выгрузить каталог товаров",
+        description="Потоково выгружает все товары, отобранные теми же фильтрами, что и список товаров, "
+                    "в формате NDJSON (по объекту товара на строку) или CSV. "
+                    "Если клиент принимает gzip (`Accept-Encoding`), ответ сжимается по мере формирования.",
         parameters=[
-            OpenApiParameter(name='shop_id', type=int, location='query',
-                             description='Фильтр по ID магазина'),
-            OpenApiParameter(name='category_id', type=int, location='query',
-                             description='Фильтр по ID категории товара'),
+            OpenApiParameter(name='type', type=str, location='query', enum=['ndjson', 'csv'],
+                             description='Формат выгрузки, по умолчанию `ndjson`'),
         ],
-        responses=ProductInfoSerializer(many=True),
+        responses={
+            200: {'description': 'Файл выгрузки'},
+            400: {'description': 'Неверные параметры запроса'},
+        },
         tags=["Информация о товарах"]
     )
-    def get(self, request):
-        query = Q(shop__state=True)
-        shop_id = request.query_params.get('shop_id')
-        category_id = request.query_params.get('category_id')
-        if shop_id:
-            query = query & Q(shop_id=shop_id)
-        if category_id:
-            query = query & Q(product__category_id=category_id)
-        queryset = ProductInfo.objects.filter(query).select_related('shop', 'product__category').prefetch_related(
-            'product_parameter__parameter').distinct()
-        serializer = ProductInfoSerializer(queryset, many=True)
-        return Response(serializer.data)
+    def get(self, request, *args, **kwargs):
+        """
+            Выгружает каталог товаров в формате NDJSON или CSV.
+        """
+        export_type = request.query_params.get('type', 'ndjson')
+        if export_type not in self.export_types:
+            return Response({'Status': False, 'Errors': f'Допустимые форматы: {", ".join(self.export_types)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            self.range_filters
+        except ValueError as e:
+            return Response({'Status': False, 'Errors': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.get_queryset().order_by('id')
+        if export_type == 'csv':
+            rows = csv_rows(queryset)
+        else:
+            rows = ndjson_rows(queryset, self.get_serializer_class(), self.get_serializer_context())
+        content = chunk_rows(rows)
+        compress = 'gzip' in request.headers.get('Accept-Encoding', '')
+        response = StreamingHttpResponse(gzip_stream(content) if compress else content,
+                                         content_type=self.export_types[export_type])
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        response['Content-Disposition'] = f'attachment; filename="products.{export_type}"'
+        return response
 
 
 class PartnerState(APIView):
@@ -676,7 +877,11 @@ class PartnerState(APIView):
         new_state = request.data.get('state')
         if new_state:
             try:
-                Shop.objects.filter(user_id=request.user.id).update(state=strtobool(new_state))
+                state = strtobool(new_state)
+                Shop.objects.filter(user_id=request.user.id).update(state=state)
+                CatalogItem.objects.filter(shop__user_id=request.user.id).update(shop_state=state)
+                for shop_id in Shop.objects.filter(user_id=request.user.id).values_list('id', flat=True):
+                    bump_catalog_version(shop_id)
                 return JsonResponse({'Status': True}, status=status.HTTP_200_OK)
             except ValueError as error:
                 return JsonResponse({'Status': False, 'Errors': str(error)}, status=status.HTTP_400_BAD_REQUEST)
@@ -692,7 +897,8 @@ class PartnerUpdate(APIView):
     @extend_schema(
         summary="Обновление прайса продавца по внешней ссылке",
         description="Принимает URL-адрес и проверяет его корректность. "
-                    "Если URL валиден, происходит попытка загрузки данных (например, файла или JSON).",
+                    "Если URL валиден, ставит в очередь задачу загрузки прайса и возвращает ее ID. "
+                    "Ход загрузки можно отслеживать по адресу `partner/update/<job_id>`.",
         request={
             'application/json': {
                 'type': 'object',
@@ -701,13 +907,26 @@ class PartnerUpdate(APIView):
                         'type': 'string',
                         'example': 'https://example.com/data.yaml ',
                         'description': 'URL, откуда будут загружаться данные'
+                    },
+                    'dry_run': {
+                        'type': 'string',
+                        'example': 'False',
+                        'description': 'Пробный запуск: загрузка откатывается, '
+                                       'в результате задачи сохраняется статистика по этапам'
                     }
                 },
                 'required': ['url']
             }
         },
         responses={
-            200: {'description': 'Данные успешно загружены'},
+            202: {
+                'description': 'Задача загрузки поставлена в очередь',
+                'type': 'object',
+                'properties': {
+                    'Status': {'type': 'boolean'},
+                    'job_id': {'type': 'string'}
+                }
+            },
             400: {'description': 'Ошибка: неверный URL или недостаточно данных'},
         },
         tags=["Партнер"]
@@ -720,33 +939,39 @@ class PartnerUpdate(APIView):
                 validator(url)
             except ValidationError as e:
                 return Response({'Status': False, 'Errors': str(e)}, status=status.HTTP_400_BAD_REQUEST)
-            stream = get(url)
-            data = yaml.safe_load(stream.content)
-            shop, created = Shop.objects.get_or_create(name=data['shop'], user_id=request.user.id)
-            for category in data['categories']:
-                new_category, created = Category.objects.get_or_create(id=category['id'], name=category['name'])
-                new_category.shops.add(shop.id)
-                new_category.save()
-            ProductInfo.objects.filter(shop_id=shop.id).delete()
-            for item in data['goods']:
-                product, created = Product.objects.get_or_create(category_id=item['category'], name=item['name'])
-                product_info = ProductInfo.objects.create(product_id=product.id,
-                                                          shop_id=shop.id,
-                                                          model=item['model'],
-                                                          ext_id=item['id'],
-                                                          quantity=item['quantity'],
-                                                          price=item['price'],
-                                                          price_rrc=item['price_rrc'])
-                for name, value in item['parameters'].items():
-                    parameter, created = Parameter.objects.get_or_create(name=name)
-                    ProductParameter.objects.create(parameter_id=parameter.id,
-                                                    product_info_id=product_info.id,
-                                                    value=value)
-            return JsonResponse({'Status': True}, status=status.HTTP_200_OK)
+            try:
+                dry_run = bool(strtobool(str(request.data.get('dry_run', 'False'))))
+            except ValueError as e:
+                return Response({'Status': False, 'Errors': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            job = ImportJob.objects.create(user_id=request.user.id, url=url, dry_run=dry_run)
+            import_price_list_task.delay(str(job.id))
+            return Response({'Status': True, 'job_id': str(job.id)}, status=status.HTTP_202_ACCEPTED)
 
         return Response({'Status': False, 'Errors': 'Недостаточно аргументов'}, status=status.HTTP_400_BAD_REQUEST)
 
 
+class PartnerUpdateStatus(APIView):
+    """
+        Класс для просмотра состояния загрузки прайса продавца
+    """
+    permission_classes = (IsAuthenticated, IsVendor)
+
+    @extend_schema(
+        summary="Состояние задачи загрузки прайса",
+        description="Возвращает этап задачи, число обработанных товаров, скорость загрузки и ошибки.",
+        responses={
+            200: ImportJobSerializer,
+            404: {'description': 'Задача не найдена'}},
+        tags=["Партнер"]
+    )
+    def get(self, request, job_id):
+        job = ImportJob.objects.filter(id=job_id, user_id=request.user.id).first()
+        if not job:
+            return Response({'Status': False, 'Errors': 'Задача не найдена'}, status=status.HTTP_404_NOT_FOUND)
+        serializer = ImportJobSerializer(job)
+        return Response(serializer.data)
+
+
 class PartnerOrders(APIView):
     """
     Класс для вывода списка заказов продавца
@@ -757,18 +982,29 @@ class PartnerOrders(APIView):
         summary="Получить список заказов продавца",
         description="Возвращает список всех заказов, в которых есть товары, принадлежащие магазинам текущего пользователя."
                     "Включает общую сумму заказа и детали товаров.",
+        parameters=[
+            OpenApiParameter(name='fields', type=str, location='query',
+                             description='Поля товаров через запятую, например `id,price,product`'),
+            OpenApiParameter(name='expand', type=str, location='query',
+                             description='Вложенные объекты товаров через запятую: `product`, `product_parameter`. '
+                                         'По умолчанию раскрываются все'),
+        ],
         responses={200: OrderSerializer(many=True)},
         tags=["Партнер"]
     )
     def get(self, request):
+        # Сумма считается только по позициям магазинов продавца: аннотация использует join фильтра,
+        # а хранимая `Order.total_sum` включает позиции других продавцов
         orders = Order.objects.filter(order_items__product_info__shop__user_id=request.user.id).exclude(
-            state='basket').prefetch_related(
-            'order_items__product_info__product__category',
-            'order_items__product_info__product_parameter__parameter',
-        ).annotate(
-            total_sum=Sum(F('order_items__product_info__price') * F('order_items__quantity'))
-        ).distinct()
-        serializer = OrderSerializer(orders, many=True)
+            state='basket').prefetch_related('order_items__product_info').annotate(
+            vendor_total_sum=Sum(Cast(Coalesce('order_items__price', 'order_items__product_info__price'),
+                                      BigIntegerField()) * F('order_items__quantity'))).distinct()
+        context = ProductInfoSerializer.sparse_context(request.query_params)
+        orders = ProductInfoSerializer.load_related(orders, context, prefix='order_items__product_info__')
+        orders = list(orders)
+        for order in orders:
+            order.total_sum = order.vendor_total_sum
+        serializer = OrderSerializer(orders, many=True, context=context)
         return Response(serializer.data)
 
 
@@ -782,23 +1018,27 @@ class BasketView(APIView):
         summary="Получить содержимое корзины",
         description="Возвращает текущее состояние корзины пользователя (только один заказ со статусом 'basket'). "
                     "Включает информацию о товарах, категориях и общей стоимости.",
+        parameters=[
+            OpenApiParameter(name='fields', type=str, location='query',
+                             description='Поля товаров через запятую, например `id,price,product`'),
+            OpenApiParameter(name='expand', type=str, location='query',
+                             description='Вложенные объекты товаров через запятую: `product`, `product_parameter`. '
+                                         'По умолчанию раскрываются все'),
+        ],
         responses={200: OrderSerializer(many=True)},
         tags=["Корзина"]
     )
     def get(self, request):
-        basket = Order.objects.filter(user_id=request.user.id, state='basket').prefetch_related(
-            'order_items__product_info__product__category',
-            'order_items__product_info__product_parameter__parameter',
-        ).annotate(
-            total_sum=Sum(F('order_items__product_info__price') * F('order_items__quantity'))
-        ).distinct()
-        serializer = OrderSerializer(basket, many=True)
+        context = ProductInfoSerializer.sparse_context(request.query_params)
+        basket = get_basket_store().baskets(request.user.id, context)
+        serializer = OrderSerializer(basket, many=True, context=context)
         return Response(serializer.data)
 
     @extend_schema(
         summary="Добавить товар(ы) в корзину",
         description="Добавляет один или несколько товаров в корзину пользователя. "
-                    "Если корзины нет — создаётся новая.",
+                    "Если корзины нет — создаётся новая. Количество товара, который уже есть в корзине, "
+                    "увеличивается. Если хотя бы одна позиция неверна, корзина не изменяется.",
         request={
             'application/json': {
                 'type': 'object',
@@ -832,16 +1072,28 @@ class BasketView(APIView):
                             status=status.HTTP_400_BAD_REQUEST)
 
         if items_data:
-            added_items = 0
-            basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
-            for item in items_data:
-                item['order'] = basket.id
-                serializer = OrderedItemsSerializer(data=item)
-                if serializer.is_valid():
-                    serializer.save()
-                    added_items += 1
-                else:
-                    return Response({'Status': False, 'Errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+            serializer = BasketItemSerializer(data=items_data, many=True)
+            if not serializer.is_valid():
+                return Response({'Status': False, 'Errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+            # Повторяющиеся товары объединяются: одна позиция не может быть изменена запросом дважды
+            quantities = {}
+            for item in serializer.validated_data:
+                quantities[item['product_info']] = quantities.get(item['product_info'], 0) + item['quantity']
+            if max(quantities.values()) > MAX_QUANTITY:
+                return Response({'Status': False, 'Errors': {'quantity': f'Количество должно быть не более '
+                                                                          f'{MAX_QUANTITY}'}},
+                                status=status.HTTP_400_BAD_REQUEST)
+            existing = set(ProductInfo.objects.published().filter(id__in=quantities).values_list('id', flat=True))
+            missing = [product_id for product_id in quantities if product_id not in existing]
+            if missing:
+                return Response({'Status': False, 'Errors': {'product_info': f'Продукты с такими ID не существуют: '
+                                                                              f'{", ".join(map(str, missing))}'}},
+                                status=status.HTTP_400_BAD_REQUEST)
+            # Позиции записываются одной операцией, поэтому добавляются все или ни одной
+            try:
+                added_items = get_basket_store().add(request.user.id, quantities)
+            except ValueError as e:
+                return Response({'Status': False, 'Errors': {'quantity': str(e)}}, status=status.HTTP_400_BAD_REQUEST)
             return Response({'Status': True, 'detail': f'Товаров добавлено: {added_items}'}, status=status.HTTP_200_OK)
 
         return Response({'Status': False, 'Errors': 'Недостаточно аргументов'}, status=status.HTTP_400_BAD_REQUEST)
@@ -868,24 +1120,18 @@ class BasketView(APIView):
         items_data = request.data.get('items')
 
         if items_data:
-            id_list = items_data.split(',')
-            basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
-            query = Q()
-            items_found = False
-            for item_id in id_list:
-                if item_id.isdigit():
-                    query = query | Q(order_id=basket.id, id=item_id)
-                    items_found = True
-            if items_found:
-                deleted_count = OrderItem.objects.filter(query).delete()[0]
+            item_ids = [int(item_id) for item_id in items_data.split(',') if item_id.isdigit()]
+            if item_ids:
+                deleted_count = get_basket_store().delete(request.user.id, item_ids)
                 return Response({'Status': True, 'detail': f'Товаров удалено: {deleted_count}'},
                                 status=status.HTTP_200_OK)
         return Response({'Status': False, 'Errors': 'Недостаточно аргументов'}, status=status.HTTP_400_BAD_REQUEST)
 
     @extend_schema(
         summary="Обновить количество товаров в корзине",
-        description="Изменяет количество определённых товаров в корзине. "
-                    "Ожидает список объектов с полями `id` и `quantity`.",
+        description="Изменяет количество определённых товаров в корзине одним запросом. "
+                    "Ожидает список объектов с полями `id` и `quantity`. В ответе `updated` - ID измененных "
+                    "позиций, `ignored` - ID позиций, которых нет в корзине или с неверным количеством.",
         request={
             'application/json': {
                 'type': 'object',
@@ -917,13 +1163,24 @@ class BasketView(APIView):
             return Response({'Status': False, 'Errors': 'Неправильный формат запроса'},
                             status=status.HTTP_400_BAD_REQUEST)
         if items_data:
-            updated_items = 0
-            basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
+            quantities, checked = {}, []
             for item in items_data:
-                if type(item['id']) == int and type(item['quantity']) == int and item['quantity'] > 0:
-                    updated_items += OrderItem.objects.filter(order_id=basket.id, id=item['id']).update(
-                        quantity=item['quantity'])
-            return Response({'Status': True, 'detail': f'Товаров обновлено: {updated_items}'},
+                item_id = item.get('id') if isinstance(item, dict) else None
+                if type(item_id) == int and type(item.get('quantity')) == int \
+                        and 0 < item_id <= MAX_ID and 0 < item['quantity'] <= MAX_QUANTITY:
+                    quantities[item_id] = item['quantity']
+                # ID другого типа (строка, список, объект) игнорируется как есть, без сравнения с другими ID
+                checked.append((item_id, type(item_id) == int or item_id is None))
+            updated = get_basket_store().update(request.user.id, quantities)
+            updated_ids, ignored_ids, ignored = set(updated), set(), []
+            for item_id, comparable in checked:
+                if not comparable:
+                    ignored.append(item_id)
+                elif item_id not in updated_ids and item_id not in ignored_ids:
+                    ignored_ids.add(item_id)
+                    ignored.append(item_id)
+            return Response({'Status': True, 'detail': f'Товаров обновлено: {len(updated)}',
+                             'updated': updated, 'ignored': ignored},
                             status=status.HTTP_200_OK)
 
         return Response({'Status': False, 'Errors': 'Недостаточно аргументов'}, status=status.HTTP_400_BAD_REQUEST)
@@ -939,23 +1196,30 @@ class OrderView(APIView):
         summary="Получить список заказов пользователя",
         description="Возвращает список всех оформленных заказов пользователя (кроме корзины). "
                     "Включает информацию о товарах, категориях и общей сумме заказа.",
+        parameters=[
+            OpenApiParameter(name='fields', type=str, location='query',
+                             description='Поля товаров через запятую, например `id,price,product`'),
+            OpenApiParameter(name='expand', type=str, location='query',
+                             description='Вложенные объекты товаров через запятую: `product`, `product_parameter`. '
+                                         'По умолчанию раскрываются все'),
+        ],
         responses={200: OrderSerializer(many=True)},
         tags=["Заказы"]
     )
     def get(self, request):
         basket = Order.objects.filter(user_id=request.user.id).exclude(state='basket').prefetch_related(
-            'order_items__product_info__product__category',
-            'order_items__product_info__product_parameter__parameter',
-        ).annotate(
-            total_sum=Sum(F('order_items__product_info__price') * F('order_items__quantity'))
-        ).distinct()
-        serializer = OrderSerializer(basket, many=True)
+            'order_items__product_info')
+        context = ProductInfoSerializer.sparse_context(request.query_params)
+        basket = ProductInfoSerializer.load_related(basket, context, prefix='order_items__product_info__')
+        serializer = OrderSerializer(basket, many=True, context=context)
         return Response(serializer.data)
 
     @extend_schema(
         summary="Подтвердить заказ и отправить уведомление",
-        description="Обновляет состояние указанного заказа на 'new' и отправляет email-уведомление пользователю. "
-                    "Требует ID заказа и контактной информации.",
+        description="Обновляет состояние указанной корзины на 'new', резервирует товар по всем позициям "
+                    "и отправляет email-уведомление пользователю. Требует ID заказа и контактной информации. "
+                    "Если товара не хватает, заказ не оформляется, а в `shortfalls` возвращаются позиции "
+                    "с запрошенным (`quantity`) и доступным (`available`) количеством.",
         request={
             'application/json': {
                 'type': 'object',
@@ -968,24 +1232,28 @@ class OrderView(APIView):
         },
         responses={
             200: {'description': 'Заказ успешно подтверждён'},
-            400: {'description': 'Ошибка валидации или отсутствуют аргументы'}
+            400: {'description': 'Ошибка валидации или отсутствуют аргументы'},
+            409: {'description': 'Недостаточно товара для оформления заказа'}
         },
         tags=["Заказы"]
     )
     def post(self, request):
         if {'id', 'contact'}.issubset(request.data):
             if request.data['id'].isdigit():
-
+                # Корзина из кэша записывается в БД до оформления заказа
+                basket_store = get_basket_store()
+                basket_store.flush([request.user.id])
                 try:
-                    is_updated = Order.objects.filter(user_id=request.user.id, id=request.data['id']).update(
-                        contact_id=request.data['contact'],
-                        state='new'
-                    )
+                    is_updated = checkout_order(request.user.id, request.data['id'], request.data['contact'])
                 except IntegrityError as e:
                     print(e)
                     return Response({'Status': False, 'Errors': 'Ошибка'}, status=status.HTTP_400_BAD_REQUEST)
+                except InsufficientStock as e:
+                    return Response({'Status': False, 'Errors': 'Недостаточно товара', 'shortfalls': e.shortfalls},
+                                    status=status.HTTP_409_CONFLICT)
                 else:
                     if is_updated:
+                        basket_store.evict([request.user.id])
                         order = Order.objects.get(user_id=request.user.id, id=request.data['id'])
                         send_mail_task.delay(
                             subject="Изменение статуса заказа",
@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework.authtoken',
     'django_rest_passwordreset',
     'cachalot',
@@ -155,6 +156,15 @@ REST_FRAMEWORK = {
         'user': '50/minute',
         'anon': '20/minute'
     },
+    'DEFAULT_RENDERER_CLASSES': [
+        'backend.renderers.UJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'backend.parsers.UJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
@@ -170,6 +180,11 @@ DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
 DJANGO_REST_MULTITOKENAUTH_RESET_TOKEN_EXPIRY_HOURS = 24  # время жизни токена (в часах)
 
+# Хранилище корзин: database - таблицы заказов, cache - кэш (Redis) с отложенной записью в БД
+BASKET_STORE = os.environ.get('BASKET_STORE', 'database')
+# Задержка записи корзины из кэша в БД после изменения, с
+BASKET_FLUSH_DELAY = 5
+
 # Celery settings
 CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL", "redis://localhost:6379/0")
 CELERY_RESULT_BACKEND = os.environ.get("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
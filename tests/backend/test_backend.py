@@ -1,10 +1,35 @@
+import base64
+import csv
+import gzip
+import hashlib
+import io
+import json
 import pytest
+import yaml
 from rest_framework.test import APIClient
 from backend.models import User, EmailVerificationToken, Product, ProductInfo, Parameter, ProductParameter, \
-    Shop, Order, OrderItem, Category, Contact
+    Shop, Order, OrderItem, Category, Contact, ImportJob, CatalogItem
+from backend.serializers import ProductInfoSerializer, CatalogItemSerializer, OrderSerializer, FastListSerializer
+from rest_framework.serializers import ListSerializer
+from rest_framework.renderers import JSONRenderer
+from backend.renderers import UJSONRenderer
+from backend.parsers import UJSONParser
+from rest_framework.parsers import JSONParser
+from rest_framework.exceptions import ParseError
+from decimal import Decimal
 from yaml import safe_load
 from django.utils import timezone
 from datetime import timedelta
+from django.core.management import call_command, CommandError
+from backend.importer import import_catalog, import_price_list, ImportProfiler
+from backend.catalog import refresh_catalog
+from backend.price_list import YamlPriceList, open_price_list
+from backend.tasks import import_price_list_task, flush_basket_task
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection, transaction
+from django.core.cache import cache
+from backend.basket import checkout_order, InsufficientStock, CacheBasketStore, update_order_totals
 
 base_url = '/api/v1'
 
@@ -81,6 +106,7 @@ def shop():
             ProductParameter.objects.create(parameter_id=parameter.id,
                                             product_info_id=product_info.id,
                                             value=value)
+    refresh_catalog(shop.id)
 
     return shop
 
@@ -219,13 +245,63 @@ def test_get_shops(api_client):
 
 
 @pytest.mark.django_db
-def test_partner_update(api_client, active_seller):
+def test_partner_update(api_client, active_seller, monkeypatch):
+    queued = []
+    monkeypatch.setattr('backend.views.import_price_list_task.delay', queued.append)
     api_client.force_authenticate(user=active_seller)
     data = {
         'url': 'https://raw.githubusercontent.com/netology-code/python-final-diplom/master/data/shop1.yaml',
     }
     response = api_client.post(f"{base_url}/partner/update", data=data)
+    assert response.status_code == 202
+    job_id = response.json()['job_id']
+    assert queued == [job_id]
+
+    response = api_client.get(f"{base_url}/partner/update/{job_id}")
     assert response.status_code == 200
+    assert response.json()['phase'] == 'queued'
+
+
+@pytest.mark.django_db
+def test_import_price_list_task(api_client, active_seller, monkeypatch):
+    requests_headers = []
+
+    def download(url, **validators):
+        requests_headers.append(validators)
+        if validators.get('etag') == '"v2"':
+            return None, validators
+        with open('shop1.yaml', 'rb') as file:
+            digest = hashlib.sha256(file.read()).hexdigest()
+        return open('shop1.yaml', 'rb'), {'etag': '"v1"', 'last_modified': '', 'content_digest': digest,
+                                          'content_type': 'application/x-yaml'}
+
+    monkeypatch.setattr('backend.tasks.download', download)
+    job = ImportJob.objects.create(user_id=active_seller.id, url='https://example.com/shop1.yaml')
+    import_price_list_task(str(job.id))
+
+    api_client.force_authenticate(user=active_seller)
+    response = api_client.get(f"{base_url}/partner/update/{job.id}")
+    assert response.status_code == 200
+    data = response.json()
+    assert data['phase'] == 'done'
+    assert data['processed'] == data['stats']['inserted'] == ProductInfo.objects.count()
+    shop = Shop.objects.get(id=data['shop'])
+    assert shop.user_id == active_seller.id
+    assert shop.url == job.url and shop.etag == '"v1"'
+
+    # Повторная загрузка того же файла не запускает импорт
+    job = ImportJob.objects.create(user_id=active_seller.id, url=job.url)
+    import_price_list_task(str(job.id))
+    job.refresh_from_db()
+    assert requests_headers[-1] == {'etag': '"v1"', 'last_modified': ''}
+    assert job.phase == 'done' and job.stats == {'not_modified': True}
+
+    # Ответ 304 Not Modified
+    Shop.objects.filter(id=shop.id).update(etag='"v2"')
+    job = ImportJob.objects.create(user_id=active_seller.id, url=job.url)
+    import_price_list_task(str(job.id))
+    job.refresh_from_db()
+    assert job.phase == 'done' and job.stats == {'not_modified': True}
 
 
 @pytest.mark.django_db
@@ -259,29 +335,59 @@ def test_get_products(api_client, shop):
 
     response = api_client.get(f"{base_url}/products")
     assert response.status_code == 200
-    data = response.json()
+    data = response.json()['results']
     assert len(data) == Product.objects.count()
 
     test_shop_id = 1
     response = api_client.get(f"{base_url}/products?shop_id={test_shop_id}")
     assert response.status_code == 200
-    data = response.json()
+    data = response.json()['results']
     assert len(data) == ProductInfo.objects.filter(shop_id=test_shop_id).count()
 
     test_category_id = 224
     response = api_client.get(f"{base_url}/products?category_id={test_category_id}")
     assert response.status_code == 200
-    data = response.json()
+    data = response.json()['results']
     assert len(data) == ProductInfo.objects.filter(product__category_id=test_category_id).select_related(
         'shop', 'product__category').prefetch_related(
             'product_parameter__parameter').count()
 
 
+@pytest.mark.django_db
+def test_get_products_keyset_pagination(api_client, active_user, shop):
+    api_client.force_authenticate(user=active_user)
+    expected = list(ProductInfo.objects.order_by('price', 'id').values_list('id', flat=True))
+
+    pages, url = [], f"{base_url}/products?ordering=price&page_size=3"
+    while url:
+        response = api_client.get(url)
+        assert response.status_code == 200
+        data = response.json()
+        pages.append([item['id'] for item in data['results']])
+        url = data['next']
+    assert [product_id for page in pages for product_id in page] == expected
+    assert all(len(page) == 3 for page in pages[:-1])
+
+    # Ссылка previous возвращает на предыдущую страницу в том же порядке
+    response = api_client.get(data['previous'])
+    assert [item['id'] for item in response.json()['results']] == pages[-2]
+
+    response = api_client.get(f"{base_url}/products", {'cursor': 'bad'})
+    assert response.status_code == 404
+    # Курсор правильного формата со значениями не того типа тоже неверный
+    for values in (['abc', 1], [1, [2]], [{}, 1], [None, 1]):
+        cursor = base64.urlsafe_b64encode(json.dumps({'v': values, 'r': False}).encode()).decode()
+        response = api_client.get(f"{base_url}/products", {'ordering': 'price', 'cursor': cursor})
+        assert response.status_code == 404
+    response = api_client.get(f"{base_url}/products", {'ordering': 'quantity'})
+    assert response.status_code == 400
+
+
 @pytest.mark.django_db
 def test_basket(api_client, active_user, shop):
 
     response = api_client.get(f"{base_url}/products")
-    products = response.json()
+    products = response.json()['results']
     data = {
         'items': [{"product_info": products[0]['id'], "quantity": 2},
                   {"product_info": products[1]['id'], "quantity": 1}]
@@ -338,7 +444,7 @@ def test_order(api_client, active_user, shop):
     contact_id = contacts[0].get('id')
 
     response = api_client.get(f"{base_url}/products")
-    products = response.json()
+    products = response.json()['results']
     data = {
         'items': [{"product_info": products[0]['id'], "quantity": 2},
                   {"product_info": products[1]['id'], "quantity": 1}]
@@ -357,3 +463,961 @@ def test_order(api_client, active_user, shop):
     assert response.status_code == 200
     assert Order.objects.get(id=basket.id).state == 'new'
 
+
+
+@pytest.mark.django_db
+def test_import_data(django_assert_max_num_queries):
+    with open('shop1.yaml', 'r', encoding='utf-8') as file:
+        data = safe_load(file)
+
+    with django_assert_max_num_queries(41):
+        call_command('import_data', 'shop1.yaml')
+
+    shop = Shop.objects.get(name=data['shop'])
+    assert ProductInfo.objects.filter(shop_id=shop.id).count() == len(data['goods'])
+    assert ProductParameter.objects.filter(product_info__shop_id=shop.id).count() == sum(
+        len(item['parameters']) for item in data['goods'])
+    assert set(shop.categories.values_list('id', flat=True)) == {category['id'] for category in data['categories']}
+
+    # Повторный импорт не дублирует продукты и параметры
+    products_count, parameters_count = Product.objects.count(), Parameter.objects.count()
+    call_command('import_data', 'shop1.yaml')
+    assert Product.objects.count() == products_count
+    assert Parameter.objects.count() == parameters_count
+    assert ProductInfo.objects.filter(shop_id=shop.id).count() == len(data['goods'])
+
+
+@pytest.mark.django_db
+def test_import_catalog_diff(active_user):
+    with open('shop1.yaml', 'r', encoding='utf-8') as file:
+        data = safe_load(file)
+    shop = Shop.objects.create(name=data['shop'])
+    stats = import_catalog(shop, data)
+    assert stats['inserted'] == len(data['goods'])
+
+    kept, changed, removed = data['goods'][0], data['goods'][1], data['goods'].pop()
+    basket = Order.objects.create(user_id=active_user.id, state='basket')
+    OrderItem.objects.create(order_id=basket.id, quantity=1,
+                             product_info=ProductInfo.objects.get(shop_id=shop.id, ext_id=kept['id']))
+    changed['price'] += 100
+    data['goods'].append({**removed, 'id': 1, 'parameters': {'Цвет': 'белый'}})
+
+    stats = import_catalog(shop, data)
+    assert stats['inserted'] == 1
+    assert stats['updated'] == 1
+    assert stats['unchanged'] == len(data['goods']) - 2
+    assert stats['removed'] == 1
+    assert ProductInfo.objects.get(shop_id=shop.id, ext_id=changed['id']).price == changed['price']
+    assert not ProductInfo.objects.filter(shop_id=shop.id, ext_id=removed['id']).exists()
+    # Позиции корзины на неизменившиеся товары сохраняются
+    assert OrderItem.objects.filter(order_id=basket.id).count() == 1
+
+    stats = import_catalog(shop, data)
+    assert stats['unchanged'] == len(data['goods'])
+
+
+def test_yaml_price_list_streaming():
+    with open('shop1.yaml', 'r', encoding='utf-8') as file:
+        data = safe_load(file)
+    with open('shop1.yaml', 'r', encoding='utf-8') as file:
+        price_list = YamlPriceList(file)
+        assert price_list.shop == data['shop']
+        assert price_list.categories == data['categories']
+        assert list(price_list.goods()) == data['goods']
+
+    price_list = YamlPriceList('shop: shop\ncategories: []\ngoods:\n  - id: 1\nextra: value\n')
+    assert list(price_list.goods()) == [{'id': 1}]
+    assert price_list.header['extra'] == 'value'
+
+
+@pytest.mark.django_db
+def test_import_data_formats(tmp_path):
+    with open('shop1.yaml', 'r', encoding='utf-8') as file:
+        data = safe_load(file)
+    categories = {category['id']: category['name'] for category in data['categories']}
+    parameters = sorted({name for item in data['goods'] for name in item['parameters']})
+
+    jsonl_path = tmp_path / 'shop1.jsonl'
+    with open(jsonl_path, 'w', encoding='utf-8') as file:
+        file.write(json.dumps({'shop': data['shop'], 'categories': data['categories']}, ensure_ascii=False) + '\n')
+        for item in data['goods']:
+            file.write(json.dumps(item, ensure_ascii=False) + '\n')
+
+    csv_path = tmp_path / 'shop1.csv.gz'
+    with gzip.open(csv_path, 'wt', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['shop', 'category', 'category_name', 'id', 'model', 'name', 'price', 'price_rrc', 'quantity']
+                        + [f'param:{name}' for name in parameters])
+        for item in data['goods']:
+            writer.writerow([data['shop'], item['category'], categories[item['category']], item['id'], item['model'],
+                             item['name'], item['price'], item['price_rrc'], item['quantity']]
+                            + [item['parameters'].get(name, '') for name in parameters])
+
+    for path in (jsonl_path, csv_path):
+        with open(path, 'rb') as file:
+            price_list = open_price_list(file, name=str(path))
+            assert price_list.shop == data['shop']
+            goods = list(price_list.goods())
+            assert sorted(price_list.categories, key=lambda category: category['id']) == sorted(
+                data['categories'], key=lambda category: category['id'])
+        assert [{**item, 'parameters': {name: str(value) for name, value in item['parameters'].items()}}
+                for item in goods] == [
+            {**item, 'parameters': {name: str(value) for name, value in item['parameters'].items()}}
+            for item in data['goods']]
+
+    call_command('import_data', str(csv_path))
+    shop = Shop.objects.get(name=data['shop'])
+    assert ProductInfo.objects.filter(shop_id=shop.id).count() == len(data['goods'])
+    assert set(shop.categories.values_list('id', flat=True)) == set(categories)
+
+    call_command('import_data', str(jsonl_path))
+    assert ProductInfo.objects.filter(shop_id=shop.id).count() == len(data['goods'])
+
+
+@pytest.mark.django_db(transaction=True)
+def test_import_data_parallel(tmp_path):
+    with open('shop1.yaml', 'r', encoding='utf-8') as file:
+        data = safe_load(file)
+    for number in range(3):
+        with open(tmp_path / f'shop{number}.yaml', 'w', encoding='utf-8') as file:
+            yaml.safe_dump({**data, 'shop': f"{data['shop']} {number}"}, file, allow_unicode=True)
+
+    out = io.StringIO()
+    call_command('import_data', str(tmp_path), '--workers', '2', stdout=out)
+    assert out.getvalue().count(f"добавлено {len(data['goods'])}") == 3
+    for number in range(3):
+        shop = Shop.objects.get(name=f"{data['shop']} {number}")
+        assert ProductInfo.objects.filter(shop_id=shop.id).count() == len(data['goods'])
+    # Продукты общие для магазинов: параллельные загрузки не создают дубликатов
+    assert Product.objects.count() == len({(item['category'], item['name']) for item in data['goods']})
+
+    with pytest.raises(CommandError):
+        call_command('import_data', str(tmp_path / '*.csv'))
+
+
+@pytest.mark.django_db
+def test_import_data_dry_run():
+    out = io.StringIO()
+    call_command('import_data', 'shop1.yaml', '--dry-run', '--workers', '1', stdout=out)
+    output = out.getvalue()
+    for phase in ('total', 'parse', 'products', 'parameters', 'write'):
+        assert f'  {phase} ' in output
+    assert not Shop.objects.exists()
+    assert not ProductInfo.objects.exists()
+
+    with open('shop1.yaml', 'rb') as file:
+        price_list = open_price_list(file)
+        shop = Shop.objects.create(name=price_list.shop)
+        profiler = ImportProfiler()
+        with profiler.profile():
+            stats = import_price_list(shop, price_list, profiler=profiler)
+    profile = profiler.report()
+    assert profile['total']['queries'] >= sum(stats['queries'] for name, stats in profile.items() if name != 'total')
+    assert profile['write']['rows_written'] >= stats['inserted']
+
+
+@pytest.mark.django_db
+def test_import_catalog_copy():
+    with open('shop1.yaml', 'r', encoding='utf-8') as file:
+        data = safe_load(file)
+    shop = Shop.objects.create(name=data['shop'])
+    data['goods'][0]['model'] = ''
+    stats = import_catalog(shop, data, copy=True)
+    assert stats['inserted'] == ProductInfo.objects.filter(shop_id=shop.id).count() == len(data['goods'])
+
+    for item in data['goods']:
+        product_info = ProductInfo.objects.get(shop_id=shop.id, ext_id=item['id'])
+        assert product_info.model == item['model']
+        assert dict(product_info.product_parameter.values_list('parameter__name', 'value')) == {
+            name: str(value) for name, value in item['parameters'].items()}
+
+    # Последовательность не пересекается с зарезервированными идентификаторами
+    new_shop = Shop.objects.create(name='shop2')
+    import_catalog(new_shop, data)
+    assert ProductInfo.objects.count() == 2 * len(data['goods'])
+    assert import_catalog(shop, data, copy=True)['unchanged'] == len(data['goods'])
+
+
+@pytest.mark.django_db
+def test_import_catalog_staged_publish(api_client, active_user, django_capture_on_commit_callbacks):
+    with open('shop1.yaml', 'r', encoding='utf-8') as file:
+        data = safe_load(file)
+    shop = Shop.objects.create(name=data['shop'])
+    import_catalog(shop, data)
+    url = f'{base_url}/products'
+
+    changed = data['goods'][0]
+    offer = ProductInfo.objects.get(shop_id=shop.id, ext_id=changed['id'])
+    basket = Order.objects.create(user_id=active_user.id, state='basket')
+    OrderItem.objects.create(order_id=basket.id, product_info=offer, quantity=1)
+    changed['price'] += 100
+
+    # Сбой после первого пакета: покупатели продолжают видеть опубликованный каталог целиком
+    def fail(stats):
+        raise RuntimeError('import failed')
+
+    with pytest.raises(RuntimeError):
+        import_catalog(shop, data, batch_size=1, progress=fail)
+    response = api_client.get(url, {'shop_id': shop.id})
+    assert len(response.data['results']) == len(data['goods'])
+    assert {item['id']: item['price'] for item in response.data['results']}[offer.id] == changed['price'] - 100
+
+    # Каталог обновляется в транзакции публикации: при сбое новая версия не публикуется
+    with patch('backend.importer.refresh_catalog', side_effect=RuntimeError('refresh failed')):
+        with pytest.raises(RuntimeError):
+            import_catalog(shop, data)
+    assert Shop.objects.get(id=shop.id).catalog_version == 1
+    assert ProductInfo.objects.published().get(shop_id=shop.id, ext_id=changed['id']).id == offer.id
+
+    # Публикация сбрасывает кэш ответов каталога
+    with django_capture_on_commit_callbacks(execute=True):
+        stats = import_catalog(shop, data)
+    assert stats['version'] == 2
+    assert stats['updated'] == 1
+    response = api_client.get(url, {'shop_id': shop.id})
+    assert len(response.json()['results']) == len(data['goods'])
+    new_offer = ProductInfo.objects.published().get(shop_id=shop.id, ext_id=changed['id'])
+    assert new_offer.price == changed['price']
+    # Позиция корзины перенесена на новую строку предложения, старая строка удалена
+    assert OrderItem.objects.get(order_id=basket.id).product_info_id == new_offer.id
+    assert not ProductInfo.objects.filter(id=offer.id).exists()
+
+    # Снятое с продажи предложение остается в корзине с нулевым остатком
+    removed = data['goods'].pop()
+    removed_offer = ProductInfo.objects.published().get(shop_id=shop.id, ext_id=removed['id'])
+    OrderItem.objects.create(order_id=basket.id, product_info=removed_offer, quantity=1)
+    stats = import_catalog(shop, data)
+    assert stats['removed'] == 1
+    assert ProductInfo.objects.get(id=removed_offer.id).quantity == 0
+    assert not ProductInfo.objects.published().filter(id=removed_offer.id).exists()
+
+
+@pytest.mark.django_db
+def test_get_products_sparse_fields(api_client, active_user, shop, django_assert_num_queries):
+    api_client.force_authenticate(user=active_user)
+    url = f"{base_url}/products"
+
+    # Без вложенных объектов страница загружается одним запросом, без join и prefetch
+    with django_assert_num_queries(1):
+        response = api_client.get(url, {'fields': 'id,price'})
+    assert response.status_code == 200
+    products = response.json()['results']
+    assert all(product.keys() == {'id', 'price'} for product in products)
+
+    response = api_client.get(url, {'expand': ''})
+    product = response.json()['results'][0]
+    assert 'product_parameter' not in product
+    assert product['product'] == ProductInfo.objects.get(id=product['id']).product_id
+
+    response = api_client.get(url, {'fields': 'id,product,product_parameter', 'expand': 'product'})
+    product = response.json()['results'][0]
+    assert product.keys() == {'id', 'product'}
+    assert product['product']['category']
+
+    response = api_client.get(url, {'fields': 'id,name'})
+    assert response.status_code == 400
+
+    basket = Order.objects.create(user_id=active_user.id, state='basket')
+    OrderItem.objects.create(order_id=basket.id, product_info_id=products[0]['id'], quantity=2)
+    response = api_client.get(f"{base_url}/basket", {'fields': 'id,price'})
+    assert response.status_code == 200
+    assert response.json()[0]['order_items'][0]['product_info'] == products[0]
+
+
+@pytest.mark.django_db
+def test_get_products_parameter_filters(api_client, active_user, shop):
+    api_client.force_authenticate(user=active_user)
+    url = f"{base_url}/products"
+    color = ProductParameter.objects.filter(parameter__name='Цвет').values_list('value', flat=True).first()
+    expected = set(ProductParameter.objects.filter(parameter__name='Цвет', value=color).values_list(
+        'product_info_id', flat=True))
+
+    response = api_client.get(url, {'param[Цвет]': color, 'facets': 'true'})
+    assert response.status_code == 200
+    data = response.json()
+    assert {product['id'] for product in data['results']} == expected
+    assert data['facets']['Цвет'] == {color: len(expected)}
+    assert sum(data['facets']['Встроенная память (Гб)'].values()) == ProductParameter.objects.filter(
+        parameter__name='Встроенная память (Гб)', product_info_id__in=expected).count()
+
+    memory = data['facets']['Встроенная память (Гб)']
+    value = next(iter(memory))
+    response = api_client.get(url, {'param[Цвет]': color, 'param[Встроенная память (Гб)]': value})
+    assert len(response.json()['results']) == memory[value]
+    assert 'facets' not in response.json()
+
+    response = api_client.get(url, {'param[Нет такого]': '1'})
+    assert response.json()['results'] == []
+
+    with open('shop1.yaml', 'r', encoding='utf-8') as file:
+        data = safe_load(file)
+    data['shop'] = 'shop2'
+    imported = Shop.objects.create(name=data['shop'])
+    import_catalog(imported, data)
+    # Фасеты без фильтров по параметрам рассчитываются при публикации каталога
+    response = api_client.get(url, {'shop_id': imported.id, 'facets': 'true'})
+    colors = {}
+    for item in data['goods']:
+        if 'Цвет' in item['parameters']:
+            colors[item['parameters']['Цвет']] = colors.get(item['parameters']['Цвет'], 0) + 1
+    assert response.json()['facets']['Цвет'] == colors
+
+
+@pytest.mark.django_db
+def test_get_products_search(api_client, active_user):
+    api_client.force_authenticate(user=active_user)
+    with open('shop1.yaml', 'r', encoding='utf-8') as file:
+        data = safe_load(file)
+    shop = Shop.objects.create(name=data['shop'])
+    import_catalog(shop, data)
+    url = f"{base_url}/products"
+
+    # Поиск по названию учитывает морфологию, лучшие совпадения - первыми
+    response = api_client.get(url, {'search': 'Смартфоны Apple', 'fields': 'id,product', 'page_size': 2})
+    assert response.status_code == 200
+    found = [item['product']['name'] for item in response.json()['results']]
+    assert found and all('Apple' in name for name in found)
+    next_page = api_client.get(response.json()['next']).json()['results']
+    expected = sum('Смартфон Apple' in item['name'] for item in data['goods'])
+    assert len(found) + len(next_page) == min(expected, 4)
+
+    # Поиск по модели и по значению параметра
+    response = api_client.get(url, {'search': data['goods'][0]['model']})
+    assert data['goods'][0]['id'] in {
+        ProductInfo.objects.get(id=item['id']).ext_id for item in response.json()['results']}
+    response = api_client.get(url, {'search': 'золотистый', 'fields': 'id'})
+    assert len(response.json()['results']) == sum(
+        item['parameters'].get('Цвет') == 'золотистый' for item in data['goods'])
+
+    response = api_client.get(url, {'ordering': 'rank'})
+    assert response.status_code == 400
+
+    # Постраничный обход по релевантности не повторяет и не пропускает записи с равной оценкой
+    params = {'search': 'Смартфон', 'fields': 'id'}
+    expected = [item['id'] for item in api_client.get(url, {**params, 'page_size': 500}).json()['results']]
+    assert len(expected) > 3
+    ids, page = [], api_client.get(url, {**params, 'page_size': 1}).json()
+    while True:
+        ids.extend(item['id'] for item in page['results'])
+        if not page['next'] or len(ids) > len(expected):
+            break
+        page = api_client.get(page['next']).json()
+    assert ids == expected
+
+
+@pytest.mark.django_db
+def test_catalog_read_model(api_client, active_seller, django_assert_num_queries,
+                            django_capture_on_commit_callbacks):
+    with open('shop1.yaml', 'r', encoding='utf-8') as file:
+        data = safe_load(file)
+    shop = Shop.objects.create(name=data['shop'], user_id=active_seller.id)
+    import_catalog(shop, data)
+    url = f"{base_url}/products"
+
+    # Список строится одним запросом к каталогу и совпадает с выводом предложений
+    with django_assert_num_queries(1):
+        response = api_client.get(url, {'shop_id': shop.id})
+    products = response.json()['results']
+    expected = ProductInfoSerializer(ProductInfo.objects.published().filter(shop_id=shop.id).order_by('id'),
+                                     many=True).data
+
+    def normalize(product):
+        # Порядок параметров в JSONB не сохраняется
+        parameters = sorted((parameter['parameter'], parameter['value']) for parameter in product['product_parameter'])
+        return {**product, 'product_parameter': parameters}
+
+    assert [normalize(product) for product in products] == [normalize(product) for product in expected]
+
+    # Каталог обновляется инкрементально: замененные и снятые предложения удаляются, новые добавляются
+    changed, removed = data['goods'][0], data['goods'].pop()
+    changed['price'] += 1
+    with django_capture_on_commit_callbacks(execute=True):
+        import_catalog(shop, data)
+    assert CatalogItem.objects.filter(shop_id=shop.id).count() == len(data['goods'])
+    assert CatalogItem.objects.get(shop_id=shop.id, ext_id=changed['id']).price == changed['price']
+    assert not CatalogItem.objects.filter(shop_id=shop.id, ext_id=removed['id']).exists()
+    assert set(CatalogItem.objects.values_list('id', flat=True)) == set(
+        ProductInfo.objects.published().filter(shop_id=shop.id).values_list('id', flat=True))
+
+    api_client.force_authenticate(user=active_seller)
+    with django_capture_on_commit_callbacks(execute=True):
+        api_client.post(f"{base_url}/partner/state", data={'state': 'False'})
+    response = api_client.get(url, {'shop_id': shop.id})
+    assert response.json()['results'] == []
+
+
+
+@pytest.mark.django_db
+def test_catalog_response_cache(api_client, active_seller, shop, django_assert_num_queries,
+                                django_capture_on_commit_callbacks):
+    Shop.objects.filter(id=shop.id).update(user_id=active_seller.id)
+    api_client.force_authenticate(user=active_seller)
+    url = f"{base_url}/products"
+
+    response = api_client.get(url, {'shop_id': shop.id, 'fields': 'id,price'})
+    assert response.status_code == 200
+    etag = response['ETag']
+    assert etag.startswith('"')
+
+    # Повторный запрос (в том числе с другим порядком параметров) отдается из кэша без обращения к БД
+    with django_assert_num_queries(0):
+        cached = api_client.get(f"{url}?fields=id,price&shop_id={shop.id}")
+    assert cached.status_code == 200
+    assert cached['ETag'] == etag
+    assert cached.json() == response.json()
+    with django_assert_num_queries(0):
+        response = api_client.get(url, {'shop_id': shop.id, 'fields': 'id,price'}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert not response.content
+    for view_url in ('shops', 'categories'):
+        response = api_client.get(f"{base_url}/{view_url}")
+        assert response.status_code == 200
+        response = api_client.get(f"{base_url}/{view_url}", HTTP_IF_NONE_MATCH=f'"other", {response["ETag"]}')
+        assert response.status_code == 304
+
+    # Изменение состояния магазина сбрасывает кэш его товаров и общих списков
+    with django_capture_on_commit_callbacks(execute=True):
+        api_client.post(f"{base_url}/partner/state", data={'state': 'False'})
+    response = api_client.get(url, {'shop_id': shop.id, 'fields': 'id,price'}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.json()['results'] == []
+    assert response['ETag'] != etag
+    assert api_client.get(f"{base_url}/shops").json() == []
+
+
+@pytest.mark.django_db
+def test_get_products_price_filters_and_ordering(api_client, active_user, shop):
+    api_client.force_authenticate(user=active_user)
+    url = f"{base_url}/products"
+    items = list(CatalogItem.objects.filter(shop_id=shop.id))
+    prices = sorted(item.price for item in items)
+    price_min, price_max = prices[1], prices[-2]
+    CatalogItem.objects.filter(id=items[0].id).update(quantity=0)
+
+    response = api_client.get(url, {'price_min': price_min, 'price_max': price_max, 'ordering': '-price',
+                                    'fields': 'id,price', 'page_size': 500})
+    assert response.status_code == 200
+    found = [item['price'] for item in response.json()['results']]
+    assert found == sorted((price for price in prices if price_min <= price <= price_max), reverse=True)
+
+    response = api_client.get(url, {'in_stock': 'true', 'fields': 'id', 'page_size': 500})
+    assert {item['id'] for item in response.json()['results']} == {item.id for item in items[1:]}
+
+    # Сортировка по названию продукта постранично
+    response = api_client.get(url, {'ordering': 'name', 'fields': 'id,product', 'page_size': 2})
+    names = [item['product']['name'] for item in response.json()['results']]
+    names += [item['product']['name'] for item in api_client.get(response.json()['next']).json()['results']]
+    assert names == sorted(item.product_name for item in items)[:4]
+
+    for params in ({'price_min': 'abc'}, {'price_max': '-1'}, {'in_stock': 'maybe'}):
+        response = api_client.get(url, params)
+        assert response.status_code == 400
+        assert response.json()['Status'] is False
+
+
+@pytest.mark.django_db
+def test_export_products(api_client, active_user, shop):
+    api_client.force_authenticate(user=active_user)
+    url = f"{base_url}/products/export"
+    items = CatalogItem.objects.filter(shop_id=shop.id).order_by('id')
+
+    # NDJSON сжимается gzip, если клиент его принимает; объекты совпадают с выводом списка товаров
+    response = api_client.get(url, {'fields': 'id,price,product'}, HTTP_ACCEPT_ENCODING='gzip, deflate')
+    assert response.status_code == 200
+    assert response.streaming
+    assert response['Content-Encoding'] == 'gzip'
+    assert response['Content-Type'] == 'application/x-ndjson'
+    lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+    products = api_client.get(f"{base_url}/products", {'fields': 'id,price,product', 'page_size': 500}).json()
+    assert [json.loads(line) for line in lines] == products['results']
+
+    # CSV без сжатия, с теми же фильтрами, что и у списка
+    price_max = sorted(item.price for item in items)[len(items) // 2]
+    response = api_client.get(url, {'type': 'csv', 'price_max': price_max})
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response
+    rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+    expected = [item for item in items if item.price <= price_max]
+    assert [int(row['id']) for row in rows] == [item.id for item in expected]
+    assert json.loads(rows[0]['parameters']) == expected[0].parameters
+    assert rows[0]['product_name'] == expected[0].product_name
+
+    for params in ({'type': 'xml'}, {'price_min': 'abc'}):
+        response = api_client.get(url, params)
+        assert response.status_code == 400
+        assert response.json()['Status'] is False
+
+
+@pytest.mark.django_db
+def test_fast_serialization_parity(active_user, shop, monkeypatch):
+    contact = Contact.objects.create(user=active_user, city='Москва', street='Тверская', phone='+79990000000')
+    offers = list(ProductInfo.objects.filter(shop_id=shop.id).order_by('id'))
+    for index, state in enumerate(('new', 'confirmed')):
+        order = Order.objects.create(user=active_user, state=state, contact=contact if index else None)
+        for offer in offers[index::2][:3]:
+            OrderItem.objects.create(order=order, product_info=offer, quantity=index + 1)
+
+    def serialize(serializer_class, queryset, context):
+        return serializer_class(queryset, many=True, context=context).data
+
+    contexts = [{}, {'fields': {'id', 'price', 'product'}}, {'expand': set()}, {'expand': {'product'}},
+                {'fields': {'product_parameter', 'shop'}, 'expand': {'product_parameter'}}]
+    fast = []
+    for context in contexts:
+        orders = ProductInfoSerializer.load_related(Order.objects.prefetch_related('order_items__product_info'),
+                                                    context, prefix='order_items__product_info__')
+        fast.append([
+            serialize(ProductInfoSerializer, ProductInfoSerializer.load_related(
+                ProductInfo.objects.filter(shop_id=shop.id).order_by('id'), context), context),
+            serialize(CatalogItemSerializer, CatalogItem.objects.order_by('id'), context),
+            serialize(OrderSerializer, orders, context),
+        ])
+        # Вывод записей каталога из строк values()
+        columns, represent = CatalogItemSerializer(context=context).values_representation()
+        rows = CatalogItemSerializer.annotate_values(CatalogItem.objects.order_by('id'), columns).values(*columns)
+        fast[-1].append(list(map(represent, rows)))
+
+    # Эталон - вывод полями DRF для каждого объекта
+    monkeypatch.setattr(FastListSerializer, 'to_representation', ListSerializer.to_representation)
+    for context, results in zip(contexts, fast):
+        orders = Order.objects.all()
+        expected = [
+            serialize(ProductInfoSerializer, ProductInfo.objects.filter(shop_id=shop.id).order_by('id'), context),
+            serialize(CatalogItemSerializer, CatalogItem.objects.order_by('id'), context),
+            serialize(OrderSerializer, orders, context),
+            serialize(CatalogItemSerializer, CatalogItem.objects.order_by('id'), context),
+        ]
+        # Сравнение JSON проверяет и порядок ключей
+        assert json.dumps(results) == json.dumps(expected)
+
+
+@pytest.mark.django_db
+def test_ujson_renderer_parity(api_client, active_user, shop):
+    api_client.force_authenticate(user=active_user)
+    offer = ProductInfo.objects.filter(shop_id=shop.id).first()
+    api_client.post(f"{base_url}/basket", data={'items': [{'product_info': offer.id, 'quantity': 3}]})
+
+    # Ответы кодируются ujson и совпадают с выводом стандартного JSONRenderer байт в байт
+    for url in ('products', 'basket', 'shops'):
+        response = api_client.get(f"{base_url}/{url}")
+        assert response.status_code == 200
+        assert isinstance(response.accepted_renderer, UJSONRenderer)
+        assert response.content == JSONRenderer().render(response.data)
+        if url == 'products':
+            assert 'Смартфон' in response.content.decode()
+    total_sum = api_client.get(f"{base_url}/basket").json()[0]['total_sum']
+    assert total_sum == f'{offer.price * 3}.00'
+    data = {'text': 'Кириллица / "кавычки" \u2028', 'price': Decimal('10.50'), 'created_at': timezone.now()}
+    assert UJSONRenderer().render(data) == JSONRenderer().render(data)
+
+    # Тела запросов разбираются ujson, ошибки разбора возвращают 400
+    response = api_client.post(f"{base_url}/basket", data='{"items": [', content_type='application/json')
+    assert response.status_code == 400
+    stream = io.BytesIO(json.dumps({'name': 'Магазин', 'items': [1, 2]}).encode())
+    assert UJSONParser().parse(stream) == {'name': 'Магазин', 'items': [1, 2]}
+
+    # Нечисловые константы отклоняются так же, как JSONParser, в строках они допустимы
+    def parse(parser, body):
+        try:
+            return parser.parse(io.BytesIO(body.encode()))
+        except ParseError as e:
+            return str(e.detail)
+
+    for body in ('[NaN]', '{"price": Infinity}', '-Infinity', '{"text": "NaN, Infinity"}', '[1e400]'):
+        assert parse(UJSONParser(), body) == parse(JSONParser(), body)
+    assert parse(UJSONParser(), '[NaN]').startswith('JSON parse error')
+    response = api_client.post(f"{base_url}/basket", data='{"items": [{"product_info": %d, "quantity": NaN}]}'
+                               % offer.id, content_type='application/json')
+    assert response.status_code == 400
+
+    call_command('benchmark_json', page_size=10, repeat=1, stdout=io.StringIO())
+
+
+@pytest.mark.django_db
+def test_basket_bulk_add(api_client, active_user, shop, django_assert_max_num_queries):
+    api_client.force_authenticate(user=active_user)
+    url = f"{base_url}/basket"
+    offers = list(ProductInfo.objects.filter(shop_id=shop.id).order_by('id').values_list('id', flat=True))
+
+    # Все позиции проверяются одним запросом и записываются одним запросом
+    # (плюс создание корзины и пересчет ее суммы)
+    items = [{'product_info': offer, 'quantity': 1} for offer in offers]
+    with django_assert_max_num_queries(7):
+        response = api_client.post(url, data={'items': items})
+    assert response.status_code == 200
+    assert response.json()['detail'] == f'Товаров добавлено: {len(offers)}'
+
+    # Повторное добавление и повторы в одном запросе увеличивают количество
+    with django_assert_max_num_queries(4):
+        response = api_client.post(url, data={'items': [{'product_info': offers[0], 'quantity': 2},
+                                                        {'product_info': offers[0], 'quantity': 3}]})
+    assert response.status_code == 200
+    basket = Order.objects.get(user_id=active_user.id, state='basket')
+    quantities = dict(OrderItem.objects.filter(order=basket).values_list('product_info_id', 'quantity'))
+    assert quantities == {offer: 6 if offer == offers[0] else 1 for offer in offers}
+
+    # Ошибка в любой позиции отменяет добавление всех
+    for items in ([{'product_info': offers[1], 'quantity': 1}, {'product_info': 10 ** 9, 'quantity': 1}],
+                  [{'product_info': offers[1], 'quantity': 1}, {'product_info': offers[2], 'quantity': 0}],
+                  [{'product_info': offers[1]}],
+                  [{'product_info': offers[1], 'quantity': 1}, {'product_info': offers[2], 'quantity': 2 ** 31}],
+                  [{'product_info': offers[1], 'quantity': 1}, {'product_info': 2 ** 63, 'quantity': 1}],
+                  [{'product_info': offers[1], 'quantity': 2 ** 30}, {'product_info': offers[1], 'quantity': 2 ** 30}],
+                  # Сумма с количеством в корзине не помещается в integer
+                  [{'product_info': offers[1], 'quantity': 1}, {'product_info': offers[0], 'quantity': 2 ** 31 - 6}]):
+        response = api_client.post(url, data={'items': items})
+        assert response.status_code == 400
+        assert response.json()['Status'] is False
+    assert dict(OrderItem.objects.filter(order=basket).values_list('product_info_id', 'quantity')) == quantities
+    response = api_client.post(url, data={'items': [{'product_info': offers[0], 'quantity': 2 ** 31 - 7}]})
+    assert response.status_code == 200
+    assert OrderItem.objects.get(order=basket, product_info_id=offers[0]).quantity == 2 ** 31 - 1
+
+
+@pytest.mark.django_db
+def test_basket_bulk_update(api_client, active_user, shop, django_assert_num_queries):
+    api_client.force_authenticate(user=active_user)
+    url = f"{base_url}/basket"
+    offers = list(ProductInfo.objects.filter(shop_id=shop.id).order_by('id')[:3])
+    basket = Order.objects.create(user=active_user, state='basket')
+    items = [OrderItem.objects.create(order=basket, product_info=offer, quantity=1) for offer in offers]
+    other_user = User.objects.create_user(email='other@example.com', password='Password123', is_active=True)
+    other_basket = Order.objects.create(user=other_user, state='basket')
+    foreign = OrderItem.objects.create(order=other_basket, product_info=offers[0], quantity=1)
+
+    # Все позиции обновляются одним запросом только в корзине пользователя, вторым пересчитывается сумма
+    data = {'items': [{'id': items[0].id, 'quantity': 5}, {'id': items[1].id, 'quantity': 7},
+                      {'id': items[2].id, 'quantity': 0}, {'id': foreign.id, 'quantity': 9},
+                      {'id': 10 ** 9, 'quantity': 1}, {'quantity': 1}, {'id': items[2].id, 'quantity': 2 ** 31},
+                      {'id': 2 ** 63, 'quantity': 1}]}
+    with django_assert_num_queries(2):
+        response = api_client.put(url, data=data)
+    assert response.status_code == 200
+    assert response.json()['updated'] == [items[0].id, items[1].id]
+    assert response.json()['ignored'] == [items[2].id, foreign.id, 10 ** 9, None, 2 ** 63]
+    assert [OrderItem.objects.get(id=item.id).quantity for item in items] == [5, 7, 1]
+    assert OrderItem.objects.get(id=foreign.id).quantity == 1
+
+    # ID неверного типа возвращаются в ignored, не приводя к ошибке
+    data = {'items': [{'id': [items[0].id], 'quantity': 1}, {'id': {}, 'quantity': 1}, {'id': 'x', 'quantity': 1},
+                      {'id': items[0].id, 'quantity': 6}]}
+    response = api_client.put(url, data=data)
+    assert response.status_code == 200
+    assert response.json()['updated'] == [items[0].id]
+    assert response.json()['ignored'] == [[items[0].id], {}, 'x']
+
+
+@pytest.mark.django_db
+def test_cache_basket_store(api_client, active_user, shop, settings, django_assert_max_num_queries):
+    settings.BASKET_STORE = 'cache'
+    api_client.force_authenticate(user=active_user)
+    url = f"{base_url}/basket"
+    offers = list(ProductInfo.objects.filter(shop_id=shop.id).order_by('id')[:3])
+
+    # Изменения корзины не пишут в БД (только проверка товаров и резервирование ID новых позиций):
+    # запись планируется одной отложенной задачей
+    with patch('backend.tasks.flush_basket_task') as flush_task:
+        with django_assert_max_num_queries(6) as captured:
+            response = api_client.post(url, data={'items': [{'product_info': offers[0].id, 'quantity': 2},
+                                                            {'product_info': offers[1].id, 'quantity': 1}]})
+            assert response.status_code == 200
+            api_client.post(url, data={'items': [{'product_info': offers[0].id, 'quantity': 1},
+                                                 {'product_info': offers[2].id, 'quantity': 4}]})
+        assert all(query['sql'].startswith('SELECT') for query in captured.captured_queries)
+        basket = api_client.get(url).json()
+        items = {item['product_info']['id']: item for item in basket[0]['order_items']}
+        assert {offer_id: item['quantity'] for offer_id, item in items.items()} == {
+            offers[0].id: 3, offers[1].id: 1, offers[2].id: 4}
+        assert basket[0]['total_sum'] == f'{offers[0].price * 3 + offers[1].price + offers[2].price * 4}.00'
+
+        # Количество, которое не поместится в БД, отклоняется сразу, а не при записи
+        response = api_client.post(url, data={'items': [{'product_info': offers[0].id, 'quantity': 2 ** 31 - 3}]})
+        assert response.status_code == 400
+        response = api_client.put(url, data={'items': [{'id': items[offers[1].id]['id'], 'quantity': 5}]})
+        assert response.json()['updated'] == [items[offers[1].id]['id']]
+        response = api_client.delete(url, data={'items': str(items[offers[2].id]['id'])})
+        assert response.status_code == 200
+    flush_task.apply_async.assert_called_once_with((active_user.id,), countdown=settings.BASKET_FLUSH_DELAY)
+    assert not Order.objects.filter(user=active_user).exists()
+
+    # Запись в БД сохраняет ID заказа и позиций, вывод совпадает с выводом корзины из БД
+    flush_basket_task(active_user.id)
+    cached = api_client.get(url).json()
+    assert dict(OrderItem.objects.filter(order__user=active_user).values_list('id', 'quantity')) == {
+        items[offers[0].id]['id']: 3, items[offers[1].id]['id']: 5}
+    settings.BASKET_STORE = 'database'
+    assert api_client.get(url).json() == cached
+
+    # Оформление заказа записывает корзину в БД и сбрасывает ее из кэша
+    settings.BASKET_STORE = 'cache'
+    with patch('backend.tasks.flush_basket_task'):
+        api_client.post(url, data={'items': [{'product_info': offers[2].id, 'quantity': 1}]})
+    contact = Contact.objects.create(user=active_user, city='Москва', street='Тверская', phone='+79990000000')
+    response = api_client.post(f"{base_url}/order", data={'id': str(cached[0]['id']), 'contact': str(contact.id)})
+    assert response.status_code == 200
+    order = Order.objects.get(id=cached[0]['id'])
+    assert order.state == 'new'
+    assert order.order_items.count() == 3
+    assert api_client.get(url).json() == []
+
+
+@pytest.mark.django_db
+def test_order_totals(api_client, active_user, shop):
+    api_client.force_authenticate(user=active_user)
+    url = f"{base_url}/basket"
+    offers = list(ProductInfo.objects.filter(shop_id=shop.id).order_by('id')[:2])
+
+    # Сумма и число позиций хранятся в заказе и пересчитываются при изменении корзины
+    api_client.post(url, data={'items': [{'product_info': offers[0].id, 'quantity': 2},
+                                         {'product_info': offers[1].id, 'quantity': 1}]})
+    basket = Order.objects.get(user=active_user, state='basket')
+    assert (basket.total_sum, basket.item_count) == (offers[0].price * 2 + offers[1].price, 2)
+    item = basket.order_items.get(product_info=offers[1])
+    api_client.put(url, data={'items': [{'id': item.id, 'quantity': 3}]})
+    api_client.delete(url, data={'items': str(basket.order_items.get(product_info=offers[0]).id)})
+    basket.refresh_from_db()
+    assert (basket.total_sum, basket.item_count) == (offers[1].price * 3, 1)
+
+    # При оформлении цены позиций фиксируются и не меняются вместе с ценой предложения
+    contact = Contact.objects.create(user=active_user, city='Москва', street='Тверская', phone='+79990000000')
+    response = api_client.post(f"{base_url}/order", data={'id': str(basket.id), 'contact': str(contact.id)})
+    assert response.status_code == 200
+    ProductInfo.objects.filter(id=offers[1].id).update(price=offers[1].price + 100)
+    order = api_client.get(f"{base_url}/order").json()[0]
+    assert order['total_sum'] == f'{offers[1].price * 3}.00'
+    assert order['item_count'] == 1
+    assert order['order_items'][0]['price'] == offers[1].price
+
+
+@pytest.mark.django_db
+def test_checkout_stock_reservation(api_client, active_user, shop):
+    api_client.force_authenticate(user=active_user)
+    offers = list(ProductInfo.objects.filter(shop_id=shop.id).order_by('id')[:2])
+    ProductInfo.objects.filter(id=offers[1].id).update(quantity=2)
+    api_client.post(f"{base_url}/basket", data={'items': [{'product_info': offers[0].id, 'quantity': 1},
+                                                          {'product_info': offers[1].id, 'quantity': 3}]})
+    basket = Order.objects.get(user=active_user, state='basket')
+    contact = Contact.objects.create(user=active_user, city='Москва', street='Тверская', phone='+79990000000')
+    data = {'id': str(basket.id), 'contact': str(contact.id)}
+
+    # При нехватке товара заказ не оформляется, остатки не меняются, возвращаются позиции с нехваткой
+    response = api_client.post(f"{base_url}/order", data=data)
+    assert response.status_code == 409
+    assert response.json()['shortfalls'] == [{'id': basket.order_items.get(product_info=offers[1]).id,
+                                              'product_info': offers[1].id, 'quantity': 3, 'available': 2}]
+    assert Order.objects.get(id=basket.id).state == 'basket'
+    assert ProductInfo.objects.get(id=offers[0].id).quantity == offers[0].quantity
+
+    # После оформления товар списывается с остатков предложений и каталога
+    api_client.put(f"{base_url}/basket", data={
+        'items': [{'id': basket.order_items.get(product_info=offers[1]).id, 'quantity': 2}]})
+    response = api_client.post(f"{base_url}/order", data=data)
+    assert response.status_code == 200
+    assert dict(ProductInfo.objects.filter(id__in=[offers[0].id, offers[1].id]).values_list('id', 'quantity')) == {
+        offers[0].id: offers[0].quantity - 1, offers[1].id: 0}
+    assert CatalogItem.objects.get(id=offers[1].id).quantity == 0
+
+    # Повторное оформление не списывает товар еще раз
+    response = api_client.post(f"{base_url}/order", data=data)
+    assert response.status_code == 400
+    assert ProductInfo.objects.get(id=offers[0].id).quantity == offers[0].quantity - 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_checkout_concurrent_stock_reservation(shop):
+    offers = list(ProductInfo.objects.filter(shop_id=shop.id).order_by('id')[:2])
+    ProductInfo.objects.filter(id=offers[0].id).update(quantity=50)
+    ProductInfo.objects.filter(id=offers[1].id).update(quantity=1000)
+    users = User.objects.bulk_create(User(email=f'buyer{i}@mail.ru', username=f'buyer{i}', is_active=True)
+                                     for i in range(200))
+    baskets = Order.objects.bulk_create(Order(user=user, state='basket') for user in users)
+    # Половина корзин содержит товары в обратном порядке: блокировки не должны зависеть от порядка позиций
+    OrderItem.objects.bulk_create(
+        OrderItem(order=basket, product_info=offer, quantity=1)
+        for i, basket in enumerate(baskets) for offer in (offers if i % 2 else offers[::-1]))
+
+    def checkout(basket):
+        try:
+            return checkout_order(basket.user_id, basket.id, None)
+        except InsufficientStock as e:
+            return e.shortfalls
+        finally:
+            connection.close()
+
+    # Одновременные оформления заказов на один товар не продают больше остатка
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        results = list(executor.map(checkout, baskets))
+    assert results.count(1) == 50
+    assert all(result == [{'id': result[0]['id'], 'product_info': offers[0].id, 'quantity': 1, 'available': 0}]
+               for result in results if result != 1)
+    assert Order.objects.filter(state='new').count() == 50
+    assert dict(ProductInfo.objects.filter(id__in=[offers[0].id, offers[1].id]).values_list('id', 'quantity')) == {
+        offers[0].id: 0, offers[1].id: 950}
+
+
+@pytest.mark.django_db
+def test_cache_basket_store_publish(api_client, active_user, settings, django_capture_on_commit_callbacks):
+    settings.BASKET_STORE = 'cache'
+    api_client.force_authenticate(user=active_user)
+    url = f"{base_url}/basket"
+    with open('shop1.yaml', 'r', encoding='utf-8') as file:
+        data = safe_load(file)
+    shop = Shop.objects.create(name=data['shop'])
+    import_catalog(shop, data)
+    offers = list(ProductInfo.objects.filter(shop_id=shop.id).order_by('id')[:3])
+    with patch('backend.tasks.flush_basket_task'):
+        api_client.post(url, data={'items': [{'product_info': offers[0].id, 'quantity': 1}]})
+        flush_basket_task(active_user.id)
+        api_client.post(url, data={'items': [{'product_info': offers[1].id, 'quantity': 2}]})
+    changed = next(item for item in data['goods'] if item['id'] == offers[0].ext_id)
+    changed['price'] += 100
+    store = CacheBasketStore()
+
+    # Пробный запуск откатывается и не трогает корзину в кэше и метку запланированной записи
+    with patch('backend.tasks.flush_basket_task'), django_capture_on_commit_callbacks(execute=True):
+        with transaction.atomic():
+            import_catalog(shop, data)
+            transaction.set_rollback(True)
+    assert cache.get(store.flush_key.format(active_user.id))
+    assert [line[1:] for line in cache.get(store.key.format(active_user.id))['items']] == [
+        [offers[0].id, 1], [offers[1].id, 2]]
+
+    # Изменение корзины между ее записью в БД и публикацией сохраняется, позиции переносятся на новые строки
+    flush = CacheBasketStore.flush
+
+    def flush_and_add(self, user_ids):
+        flush(self, user_ids)
+        self.add(active_user.id, {offers[2].id: 3})
+
+    with patch('backend.tasks.flush_basket_task'), patch.object(CacheBasketStore, 'flush', flush_and_add), \
+            django_capture_on_commit_callbacks(execute=True):
+        import_catalog(shop, data)
+    new_offer = ProductInfo.objects.published().get(shop_id=shop.id, ext_id=changed['id'])
+    expected = {new_offer.id: 1, offers[1].id: 2, offers[2].id: 3}
+    basket = api_client.get(url).json()[0]
+    assert {item['product_info']['id']: item['quantity'] for item in basket['order_items']} == expected
+    flush_basket_task(active_user.id)
+    assert dict(OrderItem.objects.filter(order__user=active_user).values_list('product_info_id', 'quantity')) == \
+        expected
+
+
+@pytest.mark.django_db
+def test_checkout_unpublished_offer(api_client, active_user):
+    with open('shop1.yaml', 'r', encoding='utf-8') as file:
+        data = safe_load(file)
+    shop = Shop.objects.create(name=data['shop'])
+    import_catalog(shop, data)
+    removed = data['goods'].pop()
+    offer = ProductInfo.objects.get(shop_id=shop.id, ext_id=removed['id'])
+    api_client.force_authenticate(user=active_user)
+    api_client.post(f"{base_url}/basket", data={'items': [{'product_info': offer.id, 'quantity': 1}]})
+    basket = Order.objects.get(user=active_user, state='basket')
+    contact = Contact.objects.create(user=active_user, city='Москва', street='Тверская', phone='+79990000000')
+    item = basket.order_items.get(product_info=offer)
+    import_catalog(shop, data)
+
+    # Снятое с публикации предложение не оформляется даже при ненулевом остатке в его строке
+    ProductInfo.objects.filter(id=offer.id).update(quantity=10)
+    response = api_client.post(f"{base_url}/order", data={'id': str(basket.id), 'contact': str(contact.id)})
+    assert response.status_code == 409
+    assert response.json()['shortfalls'] == [{'id': item.id, 'product_info': offer.id, 'quantity': 1,
+                                              'available': 0}]
+    assert Order.objects.get(id=basket.id).state == 'basket'
+    assert ProductInfo.objects.get(id=offer.id).quantity == 10
+
+
+@pytest.mark.django_db(transaction=True)
+def test_import_catalog_concurrent():
+    with open('shop1.yaml', 'r', encoding='utf-8') as file:
+        data = safe_load(file)
+    shop = Shop.objects.create(name=data['shop'])
+    import_catalog(shop, data)
+    changed = [{**item, 'price': item['price'] + 100} for item in data['goods']]
+    errors = []
+
+    def import_other():
+        try:
+            import_catalog(shop, {**data, 'goods': data['goods'][:1]})
+        except ValueError as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    # Второй импорт того же магазина, начатый во время первого, завершается ошибкой и не трогает его версию
+    def progress(stats):
+        if not errors:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                executor.submit(import_other).result()
+
+    stats = import_catalog(shop, {**data, 'goods': changed}, batch_size=1, progress=progress)
+    assert len(errors) == 1
+    assert stats['version'] == 2
+    assert stats['updated'] == len(changed)
+    assert sorted(ProductInfo.objects.published().filter(shop_id=shop.id).values_list('ext_id', 'price')) == sorted(
+        (item['id'], item['price']) for item in changed)
+
+    # После завершения импорта блокировка снята
+    assert import_catalog(shop, data)['version'] == 3
+
+
+@pytest.mark.django_db
+def test_order_total_sum_large(api_client, active_user, shop):
+    api_client.force_authenticate(user=active_user)
+    offer = ProductInfo.objects.filter(shop_id=shop.id).order_by('id').first()
+    response = api_client.post(f"{base_url}/basket", data={'items': [{'product_info': offer.id,
+                                                                      'quantity': 2147483647}]})
+    assert response.status_code == 200
+
+    # Сумма за пределами 10 цифр сериализуется без ошибки
+    response = api_client.get(f"{base_url}/basket")
+    assert response.status_code == 200
+    assert response.json()[0]['total_sum'] == f'{offer.price * 2147483647}.00'
+
+
+@pytest.mark.django_db
+def test_partner_orders_shop_total_sum(api_client, active_user, active_seller, shop):
+    seller_shop = Shop.objects.create(name='shop2', user_id=active_seller.id)
+    own, other = ProductInfo.objects.filter(shop_id=shop.id).order_by('id')[:2]
+    ProductInfo.objects.filter(id=own.id).update(shop_id=seller_shop.id)
+    order = Order.objects.create(user_id=active_user.id, state='new')
+    OrderItem.objects.bulk_create([OrderItem(order=order, product_info_id=own.id, quantity=2147483647, price=own.price),
+                                   OrderItem(order=order, product_info_id=other.id, quantity=1, price=other.price)])
+    update_order_totals([order.id])
+
+    # Продавец видит сумму только по позициям своих магазинов
+    api_client.force_authenticate(user=active_seller)
+    response = api_client.get(f"{base_url}/partner/orders")
+    assert response.status_code == 200
+    assert [item['total_sum'] for item in response.json()] == [f'{own.price * 2147483647}.00']
+    assert Order.objects.get(id=order.id).total_sum == own.price * 2147483647 + other.price
+
+
+@pytest.mark.django_db
+def test_cache_basket_store_unflushed_replacement(api_client, active_user, settings,
+                                                  django_capture_on_commit_callbacks):
+    settings.BASKET_STORE = 'cache'
+    api_client.force_authenticate(user=active_user)
+    url = f"{base_url}/basket"
+    with open('shop1.yaml', 'r', encoding='utf-8') as file:
+        data = safe_load(file)
+    shop = Shop.objects.create(name=data['shop'])
+    import_catalog(shop, data)
+    offer = ProductInfo.objects.filter(shop_id=shop.id).order_by('id').first()
+    changed = next(item for item in data['goods'] if item['id'] == offer.ext_id)
+
+    # Позиция добавлена в кэш перед публикацией и еще не записана в БД; замененная строка удаляется,
+    # а позиция переносится на новую строку, в том числе после нескольких публикаций подряд
+    with patch('backend.tasks.flush_basket_task'):
+        api_client.post(url, data={'items': [{'product_info': offer.id, 'quantity': 2}]})
+        for _ in range(2):
+            changed['price'] += 100
+            with django_capture_on_commit_callbacks(execute=True):
+                import_catalog(shop, data)
+    assert not ProductInfo.objects.filter(id=offer.id).exists()
+    new_offer = ProductInfo.objects.published().get(shop_id=shop.id, ext_id=changed['id'])
+    basket = api_client.get(url).json()[0]
+    assert [(item['product_info']['id'], item['quantity']) for item in basket['order_items']] == [(new_offer.id, 2)]
+    assert basket['total_sum'] == f'{changed["price"] * 2}.00'
+    flush_basket_task(active_user.id)
+    assert list(OrderItem.objects.filter(order__user=active_user).values_list('product_info_id', 'quantity')) == [
+        (new_offer.id, 2)]
@@ -1,5 +1,6 @@
 import pytest
 from unittest.mock import patch
+from django.core.cache import cache
 
 
 @pytest.fixture(autouse=True)
@@ -10,3 +11,11 @@ def mock_send_mail_task(monkeypatch):
 
     with patch('backend.tasks.send_mail_task', new=MockTask()):
         yield
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Кэш ответов каталога не должен переходить между тестами
+    cache.clear()
+    yield
+    cache.clear()